@@ -1,17 +1,127 @@
-import re
-import time
 import json
+import time
+import asyncio
+import threading
+from typing import Callable, Optional
 import requests
+from concurrent.futures import ThreadPoolExecutor
 from system_prompts import CEO_SYSTEM, CODER_SYSTEM, TESTER_SYSTEM
-from config import OPENROUTER_MODEL, OPENROUTER_API_KEY, TOOLS_SCHEMA
+from config import (
+    OPENROUTER_MODEL,
+    OPENROUTER_API_KEY,
+    TOOLS_SCHEMA,
+    LLM_REQUESTS_PER_MINUTE,
+    LLM_RATE_LIMIT_BURST,
+    HTTP_POOL_SIZE,
+    LLM_CACHE_MODE,
+    LLM_CACHE_DIR,
+    LLM_CACHE_MAX_BYTES,
+    LLM_STREAMING,
+    MAX_TOOL_BATCH,
+)
 from logger import log
+from tokens import estimate_tokens
 from database import save_message, get_messages
-from tools import dispatch_tool
+from tools import adispatch_tool
+from disk_cache import DiskCache, cache_key
+from parsing import ToolCallWatcher, extract_tool_calls, sse_deltas
+from net import RateLimiter, get_session, retry_after_seconds, reset_in_seconds
 
 
-def llm_call(messages: list[dict], system: str = "") -> str:
-    import time
+LLM_LIMITER = RateLimiter(LLM_REQUESTS_PER_MINUTE / 60, LLM_RATE_LIMIT_BURST)
+LLM_CACHE = DiskCache(LLM_CACHE_DIR, LLM_CACHE_MAX_BYTES, "llm cache")
+LLM_EXECUTOR = ThreadPoolExecutor(max_workers=HTTP_POOL_SIZE, thread_name_prefix="llm")
+
+
+LLM_STREAM_STATS = {"streams": 0, "stopped_early": 0, "ttft_s": 0.0, "tool_call_s": 0.0}
+_stream_stats_lock = threading.Lock()
+
+
+def _post_completion(payload: dict, stream: bool = False):
+    return get_session().post(
+        "https://openrouter.ai/api/v1/chat/completions",
+        headers={
+            "Authorization": f"Bearer {OPENROUTER_API_KEY}",
+            "Content-Type": "application/json",
+        },
+        json={**payload, "stream": True} if stream else payload,
+        timeout=300,
+        stream=stream,
+    )
+
+
+def _read_stream(resp, started: float, stop_when=None, on_delta=None) -> tuple[str, dict]:
+    # Closing the response mid-stream drops the connection, which is how the
+    # rest of the generation gets cancelled once stop_when fires.
+    metrics = {"ttft": None, "stopped": None}
+    parts = []
+    resp.encoding = "utf-8"
+    try:
+        for delta in sse_deltas(resp.iter_lines(decode_unicode=True)):
+            if metrics["ttft"] is None:
+                metrics["ttft"] = time.monotonic() - started
+            parts.append(delta)
+            if on_delta:
+                on_delta(delta)
+            if stop_when and stop_when(delta):
+                metrics["stopped"] = time.monotonic() - started
+                break
+    finally:
+        resp.close()
+    metrics["total"] = time.monotonic() - started
+    return "".join(parts), metrics
+
+
+def _close_when_done(future):
+    # A cancelled caller leaves its request running in LLM_EXECUTOR: close
+    # the response as soon as it arrives instead of streaming it.
+    def close(done):
+        if not done.cancelled() and done.exception() is None:
+            done.result().close()
+
+    future.add_done_callback(close)
+
+
+def _record_stream(metrics: dict, chars: int):
+    with _stream_stats_lock:
+        LLM_STREAM_STATS["streams"] += 1
+        LLM_STREAM_STATS["ttft_s"] += metrics["ttft"] or 0.0
+        if metrics["stopped"] is not None:
+            LLM_STREAM_STATS["stopped_early"] += 1
+            LLM_STREAM_STATS["tool_call_s"] += metrics["stopped"]
+    ttft = f"{metrics['ttft']:.2f}s" if metrics["ttft"] is not None else "-"
+    detail = f"ttft={ttft}"
+    if metrics["stopped"] is not None:
+        detail += f" tool_call={metrics['stopped']:.2f}s (generation stopped)"
+    log("RUN", f"📡 LLM stream: {detail} total={metrics['total']:.2f}s, {chars} chars")
+
+
+def stream_stats() -> dict:
+    with _stream_stats_lock:
+        stats = dict(LLM_STREAM_STATS)
+    stats["avg_ttft_s"] = stats["ttft_s"] / max(stats["streams"], 1)
+    stats["avg_tool_call_s"] = stats["tool_call_s"] / max(stats["stopped_early"], 1)
+    return stats
+
 
+def _transient(e: Exception) -> bool:
+    """Whether a failed completion is worth slowing every caller down for."""
+    if isinstance(e, requests.HTTPError):
+        return e.response is not None and e.response.status_code >= 500
+    return isinstance(e, (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError))
+
+
+async def allm_call(
+    messages: list[dict],
+    system: str = "",
+    stop_on_tool_call: bool = False,
+    on_delta: Optional[Callable[[str], None]] = None,
+) -> str:
+    """Chat completion text.
+
+    on_delta receives the response text as it arrives: chunk by chunk when
+    streaming, otherwise once in full. A retried request is fed again.
+    """
     all_messages = []
     if system:
         all_messages.append({"role": "system", "content": system})
@@ -22,45 +132,94 @@ def llm_call(messages: list[dict], system: str = "") -> str:
         "messages": all_messages,
     }
 
+    key = cache_key(OPENROUTER_MODEL, all_messages)
+    if LLM_CACHE_MODE in ("record", "replay"):
+        cached = LLM_CACHE.get(key)
+        if cached is not None:
+            log("RUN", f"♻️  LLM cache hit {key[:12]} (hit rate {LLM_CACHE.report()['hit_rate']:.0%})")
+            if on_delta:
+                on_delta(cached["content"])
+            return cached["content"]
+        if LLM_CACHE_MODE == "replay":
+            log("ERR", f"LLM replay cache miss {key[:12]}, no network in replay mode")
+            return "LLM ERROR: replay cache miss"
+
+    loop = asyncio.get_running_loop()
+
     for attempt in range(3):
+        await LLM_LIMITER.acquire_async()
         try:
-            resp = requests.post(
-                "https://openrouter.ai/api/v1/chat/completions",
-                headers={
-                    "Authorization": f"Bearer {OPENROUTER_API_KEY}",
-                    "Content-Type": "application/json",
-                },
-                json=payload,
-                timeout=300,
-            )
+            started = time.monotonic()
+            future = LLM_EXECUTOR.submit(_post_completion, payload, LLM_STREAMING)
+            try:
+                resp = await asyncio.wrap_future(future)
+            except asyncio.CancelledError:
+                _close_when_done(future)
+                raise
+            LLM_LIMITER.update_from_headers(resp.headers)
             if resp.status_code == 429:
-                wait = 30 * (attempt + 1)
-                log("ERR", f"Rate limit 429, waiting {wait}s...")
-                time.sleep(wait)
+                resp.close()
+                wait = retry_after_seconds(resp.headers)
+                if wait is None:
+                    wait = reset_in_seconds(resp.headers.get("X-RateLimit-Reset"))
+                if wait is None:
+                    wait = 5 * 2**attempt
+                log("ERR", f"Rate limit 429, waiting {wait:.1f}s...")
+                LLM_LIMITER.backoff(wait)
                 continue
             resp.raise_for_status()
-            time.sleep(4)
-            return resp.json()["choices"][0]["message"]["content"]
+            if LLM_STREAMING:
+                stop_when = ToolCallWatcher() if stop_on_tool_call else None
+                try:
+                    content, metrics = await loop.run_in_executor(
+                        LLM_EXECUTOR, _read_stream, resp, started, stop_when, on_delta
+                    )
+                except asyncio.CancelledError:
+                    # The reader thread outlives this coroutine; closing the
+                    # response ends it and drops the generation upstream.
+                    resp.close()
+                    raise
+                _record_stream(metrics, len(content))
+            else:
+                content = resp.json()["choices"][0]["message"]["content"]
+                if on_delta:
+                    on_delta(content)
+            if LLM_CACHE_MODE == "record":
+                LLM_CACHE.put(key, {"model": OPENROUTER_MODEL, "content": content})
+            return content
         except Exception as e:
             log("ERR", f"llm_call failed: {e}")
-            if attempt < 2:
-                time.sleep(10)
+            # 429s back off above; other client errors and bad payloads
+            # are no reason to stall the shared limiter.
+            if attempt < 2 and _transient(e):
+                LLM_LIMITER.backoff(10)
 
     return "LLM ERROR: rate limit or timeout"
 
-def llm_with_tools(
+
+def llm_call(messages: list[dict], system: str = "") -> str:
+    return asyncio.run(allm_call(messages, system))
+
+
+async def allm_with_tools(
     agent_name: str,
     system: str,
     user_prompt: str,
     sprint: int = 0,
     max_tool_calls: int = 5,
+    on_delta: Optional[Callable[[str], None]] = None,
 ) -> str:
     tool_desc = json.dumps(TOOLS_SCHEMA, indent=2, ensure_ascii=False)
 
     full_system = f"""{system}
 
-You have access to the following tools. To call a tool, respond ONLY with this JSON format (nothing else):
-{{"tool_call": true, "tool": "<name>", "args": {{...}}}}
+You have access to the following tools. To call tools, respond ONLY with this JSON format (nothing else),
+listing every call you need this turn in a single object:
+{{"tool_calls": [{{"tool": "<name>", "args": {{...}}}}]}}
+
+Independent calls (e.g. reading several files) go in the same list:
+{{"tool_calls": [{{"tool": "<name>", "args": {{...}}}}, {{"tool": "<name>", "args": {{...}}}}]}}
+They run concurrently (up to {MAX_TOOL_BATCH} per turn) and all results come back in one message.
 
 If you don't need a tool, respond normally as text.
 
@@ -68,49 +227,23 @@ Available tools:
 {tool_desc}
 """
     history = get_messages(agent_name) if agent_name != "coder" else []
+    if history:
+        history_tokens = sum(estimate_tokens(m["content"]) for m in history)
+        log(agent_name.upper()[:5], f"📚 History: {len(history)} message(s), ~{history_tokens} tokens")
     history.append({"role": "user", "content": user_prompt})
     save_message("user", agent_name, user_prompt, sprint)
 
     for _ in range(max_tool_calls):
-        time.sleep(4)
-        response = llm_call(history, full_system)
-
-        try:
-            json_match = re.search(r'\{.*"tool_call".*\}', response, re.DOTALL)
-            if json_match:
-                call = json.loads(json_match.group())
-                if call.get("tool_call"):
-                    tool_name = call["tool"]
-                    tool_args = call.get("args", {})
-                    log(
-                        agent_name.upper()[:5],
-                        f"🔧 tool_call: {tool_name}({tool_args})",
-                    )
+        response = await allm_call(history, full_system, stop_on_tool_call=True, on_delta=on_delta)
 
-                    tool_result = dispatch_tool(tool_name, tool_args)
-                    tool_result_str = (
-                        json.dumps(tool_result, ensure_ascii=False)
-                        if not isinstance(tool_result, str)
-                        else tool_result
-                    )
-
-                    history.append({"role": "assistant", "content": response})
-                    history.append(
-                        {
-                            "role": "user",
-                            "content": f"[TOOL RESULT - {tool_name}]\n{tool_result_str}",
-                        }
-                    )
-                    save_message("assistant", agent_name, response, sprint)
-                    save_message(
-                        "user",
-                        agent_name,
-                        f"[TOOL RESULT - {tool_name}]\n{tool_result_str}",
-                        sprint,
-                    )
-                    continue
-        except (json.JSONDecodeError, AttributeError):
-            pass
+        calls = extract_tool_calls(response)
+        if calls:
+            tool_message = await _run_tool_calls(agent_name, calls)
+            history.append({"role": "assistant", "content": response})
+            history.append({"role": "user", "content": tool_message})
+            save_message("assistant", agent_name, response, sprint)
+            save_message("user", agent_name, tool_message, sprint)
+            continue
 
         save_message("assistant", agent_name, response, sprint)
         return response
@@ -119,16 +252,73 @@ Available tools:
     return response
 
 
-def ceo_action(prompt: str, sprint: int = 0) -> str:
+async def _run_tool_calls(agent_name: str, calls: list[dict]) -> str:
+    # Calls run concurrently on the bounded tool executor; results come back
+    # in request order, in a single message.
+    tag = agent_name.upper()[:5]
+    skipped = calls[MAX_TOOL_BATCH:]
+    calls = calls[:MAX_TOOL_BATCH]
+
+    async def run(call: dict) -> str:
+        log(tag, f"🔧 tool_call: {call['tool']}({call['args']})")
+        try:
+            result = await adispatch_tool(call["tool"], call["args"])
+        except Exception as e:
+            result = f"Error: {e}"
+        return result if isinstance(result, str) else json.dumps(result, ensure_ascii=False)
+
+    start = time.monotonic()
+    results = await asyncio.gather(*(run(call) for call in calls))
+    if len(calls) == 1 and not skipped:
+        return f"[TOOL RESULT - {calls[0]['tool']}]\n{results[0]}"
+
+    log(tag, f"🧰 {len(calls)} tool calls in {time.monotonic() - start:.2f}s")
+    names = ", ".join(call["tool"] for call in calls)
+    blocks = [
+        f"[TOOL RESULT {i}/{len(calls)} - {call['tool']}]\n{result}"
+        for i, (call, result) in enumerate(zip(calls, results), 1)
+    ]
+    if skipped:
+        blocks.append(f"[SKIPPED] {len(skipped)} call(s) beyond the limit of {MAX_TOOL_BATCH} per turn, send them again.")
+    return f"[TOOL RESULTS - {len(calls)} calls: {names}]\n\n" + "\n\n".join(blocks)
+
+
+def llm_with_tools(
+    agent_name: str,
+    system: str,
+    user_prompt: str,
+    sprint: int = 0,
+    max_tool_calls: int = 5,
+) -> str:
+    return asyncio.run(
+        allm_with_tools(agent_name, system, user_prompt, sprint, max_tool_calls)
+    )
+
+
+async def aceo_action(prompt: str, sprint: int = 0) -> str:
     log("CEO", f"💭 {prompt[:80]}...")
-    return llm_with_tools("ceo", CEO_SYSTEM, prompt, sprint)
+    return await allm_with_tools("ceo", CEO_SYSTEM, prompt, sprint)
 
 
-def coder_action(prompt: str, sprint: int = 0) -> str:
+async def acoder_action(
+    prompt: str, sprint: int = 0, on_delta: Optional[Callable[[str], None]] = None
+) -> str:
     log("CODER", f"💻 {prompt[:80]}...")
-    return llm_with_tools("coder", CODER_SYSTEM, prompt, sprint)
+    return await allm_with_tools("coder", CODER_SYSTEM, prompt, sprint, on_delta=on_delta)
 
 
-def tester_action(prompt: str, sprint: int = 0) -> str:
+async def atester_action(prompt: str, sprint: int = 0) -> str:
     log("TEST", f"🧪 {prompt[:80]}...")
-    return llm_with_tools("tester", TESTER_SYSTEM, prompt, sprint, max_tool_calls=8)
\ No newline at end of file
+    return await allm_with_tools("tester", TESTER_SYSTEM, prompt, sprint, max_tool_calls=8)
+
+
+def ceo_action(prompt: str, sprint: int = 0) -> str:
+    return asyncio.run(aceo_action(prompt, sprint))
+
+
+def coder_action(prompt: str, sprint: int = 0) -> str:
+    return asyncio.run(acoder_action(prompt, sprint))
+
+
+def tester_action(prompt: str, sprint: int = 0) -> str:
+    return asyncio.run(atester_action(prompt, sprint))
\ No newline at end of file
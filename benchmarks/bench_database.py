@@ -0,0 +1,116 @@
+import os
+import sys
+import time
+import sqlite3
+import tempfile
+import threading
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ["DB_PATH"] = os.path.join(tempfile.mkdtemp(prefix="bench-db-"), "state.db")
+
+import database  # noqa: E402
+
+WRITES = int(os.environ.get("BENCH_WRITES", 2000))
+THREADS = int(os.environ.get("BENCH_THREADS", 4))
+CONTENT = "[TOOL RESULT - read_file]\n" + "x" * 1500
+
+
+def legacy_save_message(path: str, role: str, agent: str, content: str, sprint: int = 0):
+    # The connect/commit/close-per-call pattern database.py used before.
+    conn = sqlite3.connect(path)
+    conn.execute(
+        "INSERT INTO messages (role, agent, content, sprint) VALUES (?, ?, ?, ?)",
+        (role, agent, content, sprint),
+    )
+    conn.commit()
+    conn.close()
+
+
+def legacy_db() -> str:
+    path = os.path.join(tempfile.mkdtemp(prefix="bench-legacy-"), "state.db")
+    conn = sqlite3.connect(path)
+    conn.execute(
+        "CREATE TABLE messages (id INTEGER PRIMARY KEY AUTOINCREMENT, role TEXT NOT NULL, "
+        "agent TEXT NOT NULL, content TEXT NOT NULL, sprint INTEGER DEFAULT 0, "
+        "created_at TEXT DEFAULT (datetime('now')))"
+    )
+    conn.commit()
+    conn.close()
+    return path
+
+
+def timed(label: str, fn, writes: int) -> float:
+    start = time.perf_counter()
+    fn()
+    elapsed = time.perf_counter() - start
+    rate = writes / elapsed
+    print(f"{label:<32} {writes:>6} writes  {elapsed:7.3f}s  {rate:10.0f} writes/s")
+    return rate
+
+
+def threaded(write):
+    per_thread = WRITES // THREADS
+
+    def worker():
+        for _ in range(per_thread):
+            write()
+
+    threads = [threading.Thread(target=worker) for _ in range(THREADS)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+
+def journaled(write):
+    # save_message only enqueues while the journal is on; the rows count as
+    # written once flush_messages() has committed them.
+    def run():
+        write()
+        database.flush_messages()
+
+    return run
+
+
+def direct(write):
+    # JOURNAL_FLUSH_MS <= 0 makes save_message insert on the calling thread.
+    def run():
+        saved = database.JOURNAL_FLUSH_MS
+        database.JOURNAL_FLUSH_MS = 0
+        try:
+            write()
+        finally:
+            database.JOURNAL_FLUSH_MS = saved
+
+    return run
+
+
+def compare(title: str, legacy_write, write, writes: int):
+    before = timed(f"before: {title}", legacy_write, writes)
+    wal = timed(f"after: {title}, WAL", direct(write), writes)
+    journal = timed(f"after: {title}, WAL + journal", journaled(write), writes)
+    print(f"speedup ({title}): WAL {wal / before:.1f}x, WAL + journal {journal / before:.1f}x")
+
+
+def main():
+    database.init_db()
+
+    legacy_path = legacy_db()
+    compare(
+        "1 thread",
+        lambda: [legacy_save_message(legacy_path, "user", "ceo", CONTENT) for _ in range(WRITES)],
+        lambda: [database.save_message("user", "ceo", CONTENT) for _ in range(WRITES)],
+        WRITES,
+    )
+
+    legacy_path = legacy_db()
+    compare(
+        f"{THREADS} threads",
+        lambda: threaded(lambda: legacy_save_message(legacy_path, "user", "ceo", CONTENT)),
+        lambda: threaded(lambda: database.save_message("user", "ceo", CONTENT)),
+        WRITES // THREADS * THREADS,
+    )
+
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
@@ -0,0 +1,83 @@
+import os
+import re
+import sys
+import time
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.chdir(tempfile.mkdtemp(prefix="bench-modgraph-"))
+
+from modgraph import MODULE_GRAPH  # noqa: E402
+
+MODULES = int(os.environ.get("BENCH_MODULES", 200))
+RUNS = int(os.environ.get("BENCH_RUNS", 20))
+BODY = "\n".join(f"def helper_{i}(value):\n    return value + {i}\n" for i in range(40))
+
+
+def legacy_sort_by_dependencies(filepaths):
+    # The regex pass helpers.py used before the module graph.
+    deps = {}
+    for fpath in filepaths:
+        deps[fpath] = set()
+        try:
+            with open(fpath) as fp:
+                content = fp.read()
+            for match in re.findall(r'from \.([\w]+) import|from framework\.([\w]+) import|from src\.([\w]+) import', content):
+                dep_name = match[0] or match[1]
+                for other in filepaths:
+                    if os.path.basename(other) == f"{dep_name}.py":
+                        deps[fpath].add(other)
+        except Exception:
+            pass
+    ordered = []
+    visited = set()
+    def visit(path):
+        if path in visited:
+            return
+        visited.add(path)
+        for dep in deps.get(path, []):
+            visit(dep)
+        ordered.append(path)
+    for path in filepaths:
+        visit(path)
+    return ordered
+
+
+def write_codebase() -> list[str]:
+    root = os.path.join("output", "framework")
+    os.makedirs(root)
+    paths = []
+    for i in range(MODULES):
+        imports = "".join(f"from .mod_{j} import helper_0\n" for j in (i - 1, i - 2) if j >= 0)
+        path = os.path.join(root, f"mod_{i}.py")
+        with open(path, "w") as f:
+            f.write(imports + "\n" + BODY)
+        paths.append(path)
+    return paths
+
+
+def timed(label: str, fn) -> float:
+    start = time.perf_counter()
+    for _ in range(RUNS):
+        fn()
+    elapsed = (time.perf_counter() - start) / RUNS
+    print(f"{label:<32} {MODULES:>5} modules  {elapsed * 1000:8.2f} ms/run")
+    return elapsed
+
+
+def main():
+    paths = write_codebase()
+    legacy = legacy_sort_by_dependencies(paths)
+    ordered, cycles = MODULE_GRAPH.order(paths)
+    position = {path: i for i, path in enumerate(ordered)}
+    assert not cycles
+    assert all(position[d] < position[p] for p, deps in MODULE_GRAPH.dependency_map().items() for d in deps)
+    assert set(legacy) == set(ordered)
+
+    before = timed("before: regex scan per run", lambda: legacy_sort_by_dependencies(paths))
+    after = timed("after: cached module graph", lambda: MODULE_GRAPH.order(paths))
+    print(f"speedup: {before / after:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
@@ -0,0 +1,199 @@
+import os
+import re
+import sys
+import json
+import time
+import random
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import parsing  # noqa: E402
+
+RUNS = int(os.environ.get("BENCH_RUNS", 20))
+FUZZ_CASES = int(os.environ.get("BENCH_FUZZ", 3000))
+
+
+def legacy_extract_json(text: str):
+    # helpers.extract_json before the shared tokenizer.
+    text = "".join(c for c in text if ord(c) >= 32 or c in "\n\r\t")
+    start = text.find("{")
+    if start == -1:
+        return None
+
+    depth = 0
+    in_string = False
+    escape_next = False
+    end = -1
+
+    for i, c in enumerate(text[start:], start):
+        if escape_next:
+            escape_next = False
+            continue
+        if c == "\\" and in_string:
+            escape_next = True
+            continue
+        if c == '"':
+            in_string = not in_string
+            continue
+        if in_string:
+            continue
+        if c == "{":
+            depth += 1
+        elif c == "}":
+            depth -= 1
+            if depth == 0:
+                end = i
+                break
+
+    if end == -1:
+        return None
+
+    candidate = text[start : end + 1]
+
+    try:
+        return json.loads(candidate)
+    except json.JSONDecodeError:
+        pass
+
+    try:
+        return json.loads(candidate.encode("utf-8", errors="replace").decode("utf-8"))
+    except json.JSONDecodeError:
+        return None
+
+
+def legacy_extract_delivery(text: str):
+    # helpers.extract_delivery before the shared tokenizer.
+    delivery_match = re.search(r"<delivery>(.*?)</delivery>", text, re.DOTALL)
+    if not delivery_match:
+        return None
+
+    content = delivery_match.group(1)
+
+    ticket_id = re.search(r"<ticket_id>(.*?)</ticket_id>", content)
+    requirements = re.search(r"<requirements>(.*?)</requirements>", content)
+    files = re.findall(r'<file path="([^"]+)">(.*?)</file>', content, re.DOTALL)
+
+    cleaned_files = []
+    for path, file_content in files:
+        file_content = re.sub(r'```\w*', '', file_content)
+        file_content = file_content.strip()
+        cleaned_files.append({"path": path.strip(), "content": file_content.strip()})
+
+    return {
+        "type": "code_delivery",
+        "ticket_id": ticket_id.group(1).strip() if ticket_id else "",
+        "requirements": (
+            [r.strip() for r in requirements.group(1).split(",")]
+            if requirements
+            else []
+        ),
+        "files": cleaned_files,
+    }
+
+
+def legacy_tool_call_span(text: str):
+    # The regex agents.allm_with_tools applied to every response.
+    match = re.search(r'\{.*"tool_call".*\}', text, re.DOTALL)
+    return match.group() if match else None
+
+
+def module_source(rng: random.Random, lines: int) -> str:
+    out = ['"""Generated module."""', "import json", ""]
+    for i in range(lines // 6):
+        out += [
+            f"class Thing{i}:",
+            f'    """Holds {{"id": {i}}} and "quoted" text."""',
+            "    def run(self, value: dict) -> str:",
+            f'        data = {{"key": value.get("k{i}", "{{}}"), "n": {rng.randint(0, 99)}}}',
+            "        return json.dumps(data)",
+            "",
+        ]
+    return "\n".join(out)
+
+
+def big_delivery(rng: random.Random, files: int, lines: int) -> str:
+    parts = ["Here is the delivery.\n<delivery>\n<ticket_id>US-042</ticket_id>\n"]
+    parts.append("<requirements>httpx, pyyaml ,pydantic</requirements>\n")
+    for i in range(files):
+        parts.append(f'<file path="framework/module_{i}.py">\n```python\n{module_source(rng, lines)}\n```\n</file>\n')
+    parts.append("</delivery>\nDone.")
+    return "".join(parts)
+
+
+def big_json(rng: random.Random, items: int) -> str:
+    payload = {
+        "type": "review",
+        "approved": [f"US-{i}" for i in range(items)],
+        "rejected": [{"id": f"US-{i}", "reason": "needs {braces} and \"quotes\"\\n" * 3} for i in range(items)],
+        "new_stories": [{"title": f"Story {i}", "description": "x" * rng.randint(50, 400)} for i in range(items)],
+    }
+    return "Thinking about it, here is the review:\n" + json.dumps(payload, indent=2) + "\ntrailing } text"
+
+
+def big_tool_call(rng: random.Random, size: int) -> str:
+    code = module_source(rng, size)
+    call = json.dumps({"tool_call": True, "tool": "exec_code", "args": {"code": code}})
+    return "I'll run it.\n" + call + "\nThen check { the result }."
+
+
+ALPHABET = ['{', '}', '"', "\\", "\n", "\x01", "\x0b", "\t", "a", " ", ":", ",", "1", "é",
+            "<delivery>", "</delivery>", "<ticket_id>", "</ticket_id>", "<requirements>",
+            "</requirements>", '<file path="', '">', "</file>", "```py", "```", '"tool_call"', "true"]
+
+
+def fuzz(rng: random.Random) -> int:
+    checked = 0
+    for _ in range(FUZZ_CASES):
+        text = "".join(rng.choice(ALPHABET) for _ in range(rng.randint(0, 60)))
+        assert parsing.extract_json(text) == legacy_extract_json(text), repr(text)
+        assert parsing.extract_delivery(text) == legacy_extract_delivery(text), repr(text)
+        assert parsing.tool_call_span(text) == legacy_tool_call_span(text), repr(text)
+        checked += 1
+    return checked
+
+
+def streamed(text: str, size: int = 4) -> list:
+    # Feeds the text the way a token stream would, a few characters at a time.
+    parser = parsing.DeliveryStreamParser()
+    events = []
+    for i in range(0, len(text), size):
+        events.extend(parser.feed(text[i : i + size]))
+    return events
+
+
+def timed(label: str, fn, text: str) -> float:
+    start = time.perf_counter()
+    for _ in range(RUNS):
+        fn(text)
+    elapsed = (time.perf_counter() - start) / RUNS
+    print(f"{label:<34} {len(text) // 1024:>5} KiB  {elapsed * 1000:9.3f} ms/run")
+    return elapsed
+
+
+def main():
+    rng = random.Random(42)
+    import logger
+    logger.print = lambda *a, **k: None  # silence parse-error logs from fuzz cases
+
+    print(f"fuzz: {fuzz(rng)} random texts match the legacy parsers")
+
+    cases = [
+        ("extract_json", legacy_extract_json, parsing.extract_json, big_json(rng, 600)),
+        ("extract_delivery", legacy_extract_delivery, parsing.extract_delivery, big_delivery(rng, 12, 600)),
+        ("tool_call", legacy_tool_call_span, parsing.tool_call_span, big_tool_call(rng, 3000)),
+    ]
+    for name, before_fn, after_fn, text in cases:
+        assert before_fn(text) == after_fn(text), name
+        before = timed(f"before: {name}", before_fn, text)
+        after = timed(f"after: {name}", after_fn, text)
+        print(f"speedup ({name}): {before / after:.1f}x")
+
+    # A linear parser takes twice as long on a delivery twice as large.
+    small, large = big_delivery(rng, 12, 600), big_delivery(rng, 24, 600)
+    small_s = timed("stream: delivery", streamed, small)
+    large_s = timed("stream: delivery", streamed, large)
+    print(f"stream scaling ({len(large) / len(small):.1f}x the text): {large_s / small_s:.1f}x the time")
+
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
@@ -6,11 +6,51 @@ load_dotenv()
 OPENROUTER_API_KEY = os.environ.get("OPENROUTER_API_KEY", "")
 DB_PATH = os.environ.get("DB_PATH", "state.db")
 OPENROUTER_MODEL = os.environ.get("OPENROUTER_MODEL", "")
+LLM_REQUESTS_PER_MINUTE = float(os.environ.get("LLM_REQUESTS_PER_MINUTE", 20))
+LLM_RATE_LIMIT_BURST = int(os.environ.get("LLM_RATE_LIMIT_BURST", 4))
+HTTP_POOL_SIZE = 16
+LLM_STREAMING = os.environ.get("LLM_STREAMING", "0") == "1"
+LLM_CACHE_MODE = os.environ.get("LLM_CACHE_MODE", "off")  # off | record | replay
+LLM_CACHE_DIR = os.path.abspath(os.environ.get("LLM_CACHE_DIR", ".cache/llm"))
+LLM_CACHE_MAX_BYTES = int(os.environ.get("LLM_CACHE_MAX_BYTES", 512 * 1024**2))
+WEB_CACHE_DIR = os.path.abspath(os.environ.get("WEB_CACHE_DIR", ".cache/web"))
+WEB_CACHE_MAX_BYTES = int(os.environ.get("WEB_CACHE_MAX_BYTES", 128 * 1024**2))
+WEB_FETCH_TTL = int(os.environ.get("WEB_FETCH_TTL", 24 * 3600))
+WEB_SEARCH_TTL = int(os.environ.get("WEB_SEARCH_TTL", 6 * 3600))
+WEB_OFFLINE = os.environ.get("WEB_OFFLINE", "0") == "1"
+TOOL_WORKERS = int(os.environ.get("TOOL_WORKERS", 8))
+TEST_WORKERS = int(os.environ.get("TEST_WORKERS", 8))
+MAX_TOOL_BATCH = int(os.environ.get("MAX_TOOL_BATCH", 8))
+HISTORY_TOKEN_BUDGET = int(os.environ.get("HISTORY_TOKEN_BUDGET", 8000))
+HISTORY_SUMMARY_TOKENS = int(os.environ.get("HISTORY_SUMMARY_TOKENS", 1000))
+HISTORY_FULL_TOOL_RESULTS = 2
+MESSAGE_RETENTION_SPRINTS = int(os.environ.get("MESSAGE_RETENTION_SPRINTS", 20))
+MAINTENANCE_EVERY_SPRINTS = 10
+JOURNAL_FLUSH_MS = int(os.environ.get("JOURNAL_FLUSH_MS", 200))
+JOURNAL_MAX_BATCH = int(os.environ.get("JOURNAL_MAX_BATCH", 50))
 MAX_CODER_ATTEMPTS = 3
+CODER_CONTEXT_TOKENS = int(os.environ.get("CODER_CONTEXT_TOKENS", 12000))
+CODER_CANDIDATES = int(os.environ.get("CODER_CANDIDATES", 1))
+CODER_CANDIDATES_ON_RETRY = os.environ.get("CODER_CANDIDATES_ON_RETRY", "0") == "1"
 SPRINT_SIZE = 2
+SPRINT_WORKERS = int(os.environ.get("SPRINT_WORKERS", 1))
 RESTART_FLAG = "restart.flag"
 MAIN_SCRIPT = "main.py"
 CHECK_INTERVAL = 2 
+VENV_CACHE_DIR = os.path.abspath(os.environ.get("VENV_CACHE_DIR", ".cache/venvs"))
+VENV_CACHE_MAX_BYTES = int(os.environ.get("VENV_CACHE_MAX_BYTES", 5 * 1024**3))
+WHEELHOUSE_DIR = os.path.abspath(os.environ.get("WHEELHOUSE_DIR", ".cache/wheelhouse"))
+PIP_TIMEOUT = 300
+DEPENDENCY_FAILURE_TTL = 600
+SANDBOX_TIMEOUT = 30
+SANDBOX_TEST_MODE = os.environ.get("SANDBOX_TEST_MODE", "inline")  # inline | package
+SANDBOX_TEST_SHARDS = int(os.environ.get("SANDBOX_TEST_SHARDS", 1))
+PYC_CACHE_DIR = os.path.abspath(os.environ.get("PYC_CACHE_DIR", ".cache/pyc"))
+TEST_RESULT_CACHE_SIZE = int(os.environ.get("TEST_RESULT_CACHE_SIZE", 256))
+SANDBOX_POOL_SIZE = int(os.environ.get("SANDBOX_POOL_SIZE", 2))
+SANDBOX_POOL_MAX_JOBS = int(os.environ.get("SANDBOX_POOL_MAX_JOBS", 50))
+SANDBOX_POOL_MAX_VENVS = int(os.environ.get("SANDBOX_POOL_MAX_VENVS", 4))
+SANDBOX_PRELOAD = ["pytest", "pydantic", "requests", "yaml"]
 TOOLS_SCHEMA = [
     {
         "name": "web_search",
@@ -28,6 +68,7 @@ TOOLS_SCHEMA = [
         "parameters": {
             "code": "str - the Python code to execute",
             "requirements": "list[str] - pip packages to install (optional)",
+            "shards": "int - run the code as a pytest module split across N parallel processes (optional)",
         },
     },
     {
@@ -0,0 +1,172 @@
+import os
+import re
+import ast
+import math
+import threading
+from collections import Counter
+from snapshot import SNAPSHOT
+from modgraph import MODULE_GRAPH, module_name
+from tokens import estimate_tokens
+from logger import log
+
+WORD_RE = re.compile(r"[A-Za-z][A-Za-z0-9]+")
+STOPWORDS = {
+    "the", "and", "for", "with", "that", "this", "from", "into", "should", "must",
+    "can", "will", "are", "has", "have", "not", "all", "any", "each", "when",
+    "use", "used", "using", "able", "new", "add", "support", "implement", "user",
+    "self", "return", "none", "true", "false", "def", "class", "import", "str",
+    "int", "dict", "list", "test", "tests", "py", "output",
+}
+
+_index: dict[str, tuple[str, dict]] = {}
+_index_lock = threading.Lock()
+
+
+def terms(text: str) -> Counter:
+    words = []
+    for word in WORD_RE.findall(text):
+        for part in re.findall(r"[A-Z]?[a-z0-9]+|[A-Z]+(?![a-z])", word):
+            part = part.lower()
+            if len(part) > 2 and part not in STOPWORDS:
+                words.append(part)
+    return Counter(words)
+
+
+def _signature(node) -> str:
+    prefix = "async def" if isinstance(node, ast.AsyncFunctionDef) else "def"
+    returns = f" -> {ast.unparse(node.returns)}" if node.returns else ""
+    return f"{prefix} {node.name}({ast.unparse(node.args)}){returns}: ..."
+
+
+def _outline(tree: ast.Module) -> str:
+    lines = []
+    for node in tree.body:
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+            lines.append(_signature(node))
+        elif isinstance(node, ast.ClassDef):
+            bases = ", ".join(ast.unparse(b) for b in node.bases)
+            lines.append(f"class {node.name}({bases}):" if bases else f"class {node.name}:")
+            doc = ast.get_docstring(node)
+            if doc:
+                lines.append(f"    # {doc.strip().splitlines()[0]}")
+            members = 0
+            for item in node.body:
+                if isinstance(item, (ast.FunctionDef, ast.AsyncFunctionDef)):
+                    lines.append(f"    {_signature(item)}")
+                    members += 1
+                elif isinstance(item, ast.AnnAssign) and isinstance(item.target, ast.Name):
+                    lines.append(f"    {item.target.id}: {ast.unparse(item.annotation)}")
+                    members += 1
+            if not members:
+                lines.append("    ...")
+        elif isinstance(node, ast.Assign) and all(
+            isinstance(t, ast.Name) and t.id.isupper() for t in node.targets
+        ):
+            lines.append(f"{ast.unparse(node.targets[0])} = ...")
+    return "\n".join(lines)
+
+
+def index_file(path: str, content: str) -> dict:
+    info = {
+        "path": path,
+        "module": module_name(path),
+        "symbols": set(),
+        "outline": "\n".join(content.splitlines()[:5]),
+        "path_terms": terms(os.path.relpath(path, SNAPSHOT.root)),
+        "content_terms": terms(content),
+    }
+    if path.endswith(".py"):
+        try:
+            tree = ast.parse(content)
+        except (SyntaxError, ValueError):
+            return info
+        for node in tree.body:
+            if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+                info["symbols"].add(node.name)
+        info["outline"] = _outline(tree)
+    info["symbol_terms"] = terms(" ".join(info["symbols"]))
+    return info
+
+
+def build_index() -> dict[str, dict]:
+    entries = SNAPSHOT.entries()
+    with _index_lock:
+        for path in set(_index) - set(entries):
+            del _index[path]
+        for path, (digest, content) in entries.items():
+            cached = _index.get(path)
+            if not cached or cached[0] != digest:
+                _index[path] = (digest, index_file(path, content))
+        return {path: info for path, (_, info) in _index.items()}
+
+
+def rank_files(ticket: dict, index: dict[str, dict]) -> list[tuple[float, str]]:
+    query = terms(
+        " ".join(
+            [ticket.get("title", ""), ticket.get("description", "")]
+            + [str(c) for c in ticket.get("acceptance_criteria", [])]
+        )
+    )
+    doc_freq = Counter()
+    for info in index.values():
+        doc_freq.update(set(info["content_terms"]))
+
+    scores = {}
+    for path, info in index.items():
+        score = 0.0
+        for term in query:
+            if term not in info["content_terms"]:
+                continue
+            idf = math.log(1 + len(index) / doc_freq[term])
+            weight = 1 + math.log(info["content_terms"][term])
+            weight += 3 * (term in info["path_terms"]) + 2 * (term in info["symbol_terms"])
+            score += idf * weight
+        scores[path] = score
+
+    # Modules imported by relevant files are needed to use them correctly.
+    dependencies = MODULE_GRAPH.dependency_map()
+    boosted = dict(scores)
+    for path in index:
+        if scores[path] <= 0:
+            continue
+        for dep in dependencies.get(path, ()):
+            if dep in boosted:
+                boosted[dep] += 0.5 * scores[path]
+
+    return sorted(((score, path) for path, score in boosted.items()), key=lambda x: (-x[0], x[1]))
+
+
+def select_context(ticket: dict, budget: int) -> tuple[str, dict]:
+    index = build_index()
+    entries = SNAPSHOT.entries()
+    blocks = []
+    skipped = []
+    stats = {"full": 0, "outline": 0, "skipped": 0, "tokens": 0}
+
+    for score, path in rank_files(ticket, index):
+        full = f"\n### {path}\n```python\n{entries[path][1]}\n```\n"
+        outline = f"\n### {path} (outline only)\n```python\n{index[path]['outline']}\n```\n"
+        for kind, block in (("full", full), ("outline", outline)):
+            cost = estimate_tokens(block)
+            if stats["tokens"] + cost <= budget:
+                blocks.append(block)
+                stats[kind] += 1
+                stats["tokens"] += cost
+                break
+        else:
+            skipped.append(path)
+            stats["skipped"] += 1
+
+    if skipped:
+        blocks.append(
+            "\n### Other files (not shown, use their names only if needed)\n"
+            + "\n".join(skipped)
+            + "\n"
+        )
+    return "".join(blocks), stats
+
+
+def log_prompt_sections(sections: dict[str, str]):
+    counts = {name: estimate_tokens(text) for name, text in sections.items()}
+    detail = ", ".join(f"{name}={count}" for name, count in counts.items())
+    log("CODER", f"📏 Prompt tokens: {detail}, total={sum(counts.values())}")
\ No newline at end of file
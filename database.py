@@ -1,13 +1,57 @@
+import time
+import zlib
 import json
+import queue
+import atexit
 import sqlite3
-from config import DB_PATH
+import argparse
+import threading
+from typing import Optional
+from config import (
+    DB_PATH,
+    HISTORY_TOKEN_BUDGET,
+    HISTORY_SUMMARY_TOKENS,
+    HISTORY_FULL_TOOL_RESULTS,
+    MESSAGE_RETENTION_SPRINTS,
+    JOURNAL_FLUSH_MS,
+    JOURNAL_MAX_BATCH,
+)
+from tokens import estimate_tokens
 from logger import log
 
+_local = threading.local()
+
+PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA busy_timeout=5000",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-16000",
+    "PRAGMA foreign_keys=ON",
+)
+
+
 def get_db():
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
+    # One long-lived connection per thread: sqlite3 connections must not be
+    # shared across threads, and WAL lets those connections read while
+    # another thread writes. Statements are reused from the connection's
+    # prepared-statement cache.
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        conn = sqlite3.connect(DB_PATH, timeout=5, cached_statements=256)
+        conn.row_factory = sqlite3.Row
+        for pragma in PRAGMAS:
+            conn.execute(pragma)
+        _local.conn = conn
     return conn
 
+
+def close_db():
+    conn = getattr(_local, "conn", None)
+    if conn is not None:
+        conn.close()
+        _local.conn = None
+
 def init_db():
     conn = get_db()
     conn.executescript(
@@ -20,6 +64,47 @@ def init_db():
             sprint INTEGER DEFAULT 0,
             created_at TEXT DEFAULT (datetime('now'))
         );
+        CREATE INDEX IF NOT EXISTS idx_messages_agent_id ON messages (agent, id);
+        CREATE INDEX IF NOT EXISTS idx_messages_sprint ON messages (sprint);
+        CREATE TABLE IF NOT EXISTS message_archive (
+            sprint INTEGER NOT NULL,
+            agent TEXT NOT NULL,
+            first_id INTEGER NOT NULL,
+            last_id INTEGER NOT NULL,
+            count INTEGER NOT NULL,
+            payload BLOB NOT NULL,
+            archived_at TEXT DEFAULT (datetime('now')),
+            PRIMARY KEY (sprint, agent, first_id)
+        );
+        CREATE TABLE IF NOT EXISTS summaries (
+            agent TEXT PRIMARY KEY,
+            upto_id INTEGER NOT NULL,
+            content TEXT NOT NULL,
+            updated_at TEXT DEFAULT (datetime('now'))
+        );
+        CREATE TABLE IF NOT EXISTS tickets (
+            id TEXT PRIMARY KEY,
+            title TEXT NOT NULL DEFAULT '',
+            description TEXT NOT NULL DEFAULT '',
+            acceptance_criteria TEXT NOT NULL DEFAULT '[]',
+            priority INTEGER NOT NULL DEFAULT 99,
+            status TEXT NOT NULL DEFAULT 'backlog',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            sprint INTEGER,
+            position INTEGER NOT NULL,
+            created_at TEXT DEFAULT (datetime('now')),
+            updated_at TEXT DEFAULT (datetime('now'))
+        );
+        CREATE INDEX IF NOT EXISTS idx_tickets_queue ON tickets (status, priority, position);
+        CREATE TABLE IF NOT EXISTS ticket_events (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            ticket_id TEXT NOT NULL,
+            event TEXT NOT NULL,
+            sprint INTEGER,
+            detail TEXT,
+            created_at TEXT DEFAULT (datetime('now'))
+        );
+        CREATE INDEX IF NOT EXISTS idx_ticket_events_ticket ON ticket_events (ticket_id, id);
         CREATE TABLE IF NOT EXISTS state (
             key TEXT PRIMARY KEY,
             value TEXT NOT NULL
@@ -27,26 +112,187 @@ def init_db():
     """
     )
     conn.commit()
-    conn.close()
+    _migrate_state_tickets(conn)
     log("DB", "✅ Database initialized")
 
+class MessageJournal:
+    # Write-behind buffer for save_message: rows are queued and a background
+    # thread inserts them in one transaction every flush_ms or max_batch rows.
+    # A hard crash loses at most that window; flush() is called on shutdown,
+    # at sprint boundaries and before any read of the messages table.
+    def __init__(self, flush_ms: int, max_batch: int):
+        self.flush_s = flush_ms / 1000
+        self.max_batch = max_batch
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=self._run, name="message-journal", daemon=True)
+        self.thread.start()
+
+    def put(self, row: tuple):
+        self.queue.put(row)
+
+    def _write(self, batch: list[tuple]):
+        for attempt in range(3):
+            try:
+                conn = get_db()
+                with conn:
+                    conn.executemany(
+                        "INSERT INTO messages (role, agent, content, sprint) VALUES (?, ?, ?, ?)",
+                        batch,
+                    )
+                return
+            except sqlite3.Error as e:
+                log("ERR", f"message journal write failed ({attempt + 1}/3): {e}")
+                time.sleep(0.2 * (attempt + 1))
+        log("ERR", f"message journal dropped {len(batch)} message(s)")
+
+    def _run(self):
+        while True:
+            batch = [self.queue.get()]
+            deadline = time.monotonic() + self.flush_s
+            while len(batch) < self.max_batch:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(self.queue.get(timeout=timeout))
+                except queue.Empty:
+                    break
+            try:
+                self._write(batch)
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+
+    def flush(self):
+        self.queue.join()
+
+
+_journal = None
+_journal_lock = threading.Lock()
+
+
+def _get_journal() -> Optional[MessageJournal]:
+    global _journal
+    if JOURNAL_FLUSH_MS <= 0:
+        return None
+    with _journal_lock:
+        if _journal is None:
+            _journal = MessageJournal(JOURNAL_FLUSH_MS, JOURNAL_MAX_BATCH)
+            atexit.register(_journal.flush)
+        return _journal
+
+
+def flush_messages():
+    if _journal is not None:
+        _journal.flush()
+
+
 def save_message(role: str, agent: str, content: str, sprint: int = 0):
+    journal = _get_journal()
+    if journal:
+        journal.put((role, agent, content, sprint))
+        return
     conn = get_db()
     conn.execute(
         "INSERT INTO messages (role, agent, content, sprint) VALUES (?, ?, ?, ?)",
         (role, agent, content, sprint),
     )
     conn.commit()
-    conn.close()
 
-def get_messages(agent: str, limit: int = 20) -> list[dict]:
+def _tool_stub(content: str) -> str:
+    header, _, body = content.partition("\n")
+    return f"{header} ({len(body)} chars, elided from history)"
+
+
+def _summary_line(role: str, content: str, length: int) -> str:
+    if content.startswith("[TOOL RESULT"):
+        header = content.split("\n", 1)[0]
+        return f"- {header} ({length} chars)"
+    text = " ".join(content.split())
+    return f"- {role}: {text[:160]}{'…' if length > 160 else ''}"
+
+
+def _fold_into_summary(conn, agent: str, summary: Optional[sqlite3.Row], upto_id: int, max_tokens: int):
+    start_id = summary["upto_id"] if summary else 0
+    if upto_id <= start_id:
+        return summary["content"] if summary else ""
+    rows = conn.execute(
+        "SELECT role, substr(content, 1, 400) AS head, length(content) AS length "
+        "FROM messages WHERE agent = ? AND id > ? AND id <= ? ORDER BY id",
+        (agent, start_id, upto_id),
+    ).fetchall()
+    lines = (summary["content"].splitlines() if summary else []) + [
+        _summary_line(r["role"], r["head"], r["length"]) for r in rows
+    ]
+    while lines and estimate_tokens("\n".join(lines)) > max_tokens:
+        lines.pop(0)
+    content = "\n".join(lines)
+    conn.execute(
+        "INSERT OR REPLACE INTO summaries (agent, upto_id, content, updated_at) "
+        "VALUES (?, ?, ?, datetime('now'))",
+        (agent, upto_id, content),
+    )
+    conn.commit()
+    return content
+
+
+def _fit_history(rows: list, budget: int) -> tuple[list[dict], Optional[int]]:
+    # Newest first: the rows that fit in budget (always at least one) and
+    # the id of the oldest row kept.
+    kept = []
+    used = 0
+    full_tool_results = 0
+    oldest_kept = None
+    for r in rows:
+        content = r["content"]
+        if content.startswith("[TOOL RESULT"):
+            if full_tool_results >= HISTORY_FULL_TOOL_RESULTS:
+                content = _tool_stub(content)
+            full_tool_results += 1
+        cost = estimate_tokens(content)
+        if kept and used + cost > budget:
+            break
+        kept.append({"role": r["role"], "content": content})
+        used += cost
+        oldest_kept = r["id"]
+    return kept, oldest_kept
+
+
+def get_messages(agent: str, limit: int = 20, budget: int = HISTORY_TOKEN_BUDGET) -> list[dict]:
+    flush_messages()
     conn = get_db()
+    summary = conn.execute(
+        "SELECT upto_id, content FROM summaries WHERE agent = ?", (agent,)
+    ).fetchone()
     rows = conn.execute(
-        "SELECT role, content FROM messages WHERE agent = ? ORDER BY id DESC LIMIT ?",
-        (agent, limit),
+        "SELECT id, role, content FROM messages WHERE agent = ? AND id > ? ORDER BY id DESC LIMIT ?",
+        (agent, summary["upto_id"] if summary else 0, limit + 1),
     ).fetchall()
-    conn.close()
-    return [{"role": r["role"], "content": r["content"]} for r in reversed(rows)]
+    older = summary is not None or len(rows) > limit
+    rows = rows[:limit]
+
+    # The summary may use up to a quarter of the budget; it is re-trimmed
+    # whenever new messages are folded into it. Its share is reserved up
+    # front whenever there is, or will be, something to summarize.
+    header = "[HISTORY SUMMARY - earlier messages]\n"
+    summary_budget = min(HISTORY_SUMMARY_TOKENS, budget // 4)
+    reserve = summary_budget + estimate_tokens(header)
+    kept, oldest_kept = _fit_history(rows, budget - reserve if older else budget)
+    if not older and len(kept) < len(rows):
+        kept, oldest_kept = _fit_history(rows, budget - reserve)
+
+    summary_content = ""
+    if oldest_kept is not None:
+        summary_content = _fold_into_summary(
+            conn, agent, summary, oldest_kept - 1, summary_budget
+        )
+    elif summary:
+        summary_content = summary["content"]
+
+    messages = list(reversed(kept))
+    if summary_content:
+        messages.insert(0, {"role": "user", "content": header + summary_content})
+    return messages
 
 def save_state(key: str, value):
     conn = get_db()
@@ -55,12 +301,210 @@ def save_state(key: str, value):
         (key, json.dumps(value)),
     )
     conn.commit()
-    conn.close()
 
 def load_state(key: str, default=None):
     conn = get_db()
     row = conn.execute("SELECT value FROM state WHERE key = ?", (key,)).fetchone()
-    conn.close()
     if row:
         return json.loads(row["value"])
-    return default
\ No newline at end of file
+    return default
+
+
+def _priority(value) -> int:
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return 99
+
+
+def _ticket_from_row(r: sqlite3.Row) -> dict:
+    return {
+        "id": r["id"],
+        "title": r["title"],
+        "description": r["description"],
+        "acceptance_criteria": json.loads(r["acceptance_criteria"]),
+        "priority": r["priority"],
+        "status": r["status"],
+        "attempts": r["attempts"],
+        "sprint": r["sprint"],
+    }
+
+
+def _log_ticket_event(conn, ticket_id: str, event: str, sprint: Optional[int], detail: str = ""):
+    conn.execute(
+        "INSERT INTO ticket_events (ticket_id, event, sprint, detail) VALUES (?, ?, ?, ?)",
+        (ticket_id, event, sprint, detail),
+    )
+
+
+def _insert_tickets(conn, items: list[dict], status: str, sprint: int) -> list[dict]:
+    stored = []
+    position = conn.execute("SELECT COALESCE(MAX(position), 0) FROM tickets").fetchone()[0]
+    for i, item in enumerate(items, 1):
+        ticket_id = str(item.get("id") or f"US-{sprint}-{i}")
+        base, n = ticket_id, 1
+        while conn.execute("SELECT 1 FROM tickets WHERE id = ?", (ticket_id,)).fetchone():
+            n += 1
+            ticket_id = f"{base}-{n}"
+        position += 1
+        conn.execute(
+            "INSERT INTO tickets (id, title, description, acceptance_criteria, priority, status, sprint, position) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (
+                ticket_id,
+                str(item.get("title", "")),
+                str(item.get("description", "")),
+                json.dumps(item.get("acceptance_criteria", []), ensure_ascii=False),
+                _priority(item.get("priority", 99)),
+                status,
+                sprint if status == "done" else None,
+                position,
+            ),
+        )
+        _log_ticket_event(conn, ticket_id, "created", sprint, status)
+        stored.append({**item, "id": ticket_id})
+    return stored
+
+
+def _migrate_state_tickets(conn):
+    if conn.execute("SELECT 1 FROM tickets LIMIT 1").fetchone():
+        return
+    rows = {
+        r["key"]: json.loads(r["value"])
+        for r in conn.execute("SELECT key, value FROM state WHERE key IN ('backlog', 'done')")
+    }
+    if not rows:
+        return
+    with conn:
+        _insert_tickets(conn, rows.get("done", []), "done", 0)
+        _insert_tickets(conn, rows.get("backlog", []), "backlog", 0)
+        conn.execute("DELETE FROM state WHERE key IN ('backlog', 'done')")
+    log("DB", f"🔀 Migrated {sum(len(v) for v in rows.values())} ticket(s) from state blobs")
+
+
+def add_tickets(items: list[dict], sprint: int = 0) -> list[dict]:
+    conn = get_db()
+    with conn:
+        return _insert_tickets(conn, items, "backlog", sprint)
+
+
+def next_tickets(limit: int) -> list[dict]:
+    rows = get_db().execute(
+        "SELECT * FROM tickets WHERE status = 'backlog' ORDER BY priority, position LIMIT ?",
+        (limit,),
+    ).fetchall()
+    return [_ticket_from_row(r) for r in rows]
+
+
+def count_tickets(status: str = "backlog") -> int:
+    return get_db().execute("SELECT COUNT(*) FROM tickets WHERE status = ?", (status,)).fetchone()[0]
+
+
+def list_tickets(status: str = "backlog") -> list[dict]:
+    rows = get_db().execute(
+        "SELECT * FROM tickets WHERE status = ? ORDER BY priority, position", (status,)
+    ).fetchall()
+    return [_ticket_from_row(r) for r in rows]
+
+
+def complete_ticket(ticket_id: str, sprint: int):
+    conn = get_db()
+    with conn:
+        conn.execute(
+            "UPDATE tickets SET status = 'done', sprint = ?, attempts = attempts + 1, "
+            "updated_at = datetime('now') WHERE id = ?",
+            (sprint, ticket_id),
+        )
+        _log_ticket_event(conn, ticket_id, "approved", sprint)
+
+
+def requeue_ticket(ticket_id: str, sprint: int, priority: Optional[int] = None, event: str = "rejected"):
+    # Requeued tickets go to the back of their priority band, like the old
+    # list-based backlog that re-appended them.
+    conn = get_db()
+    with conn:
+        conn.execute(
+            "UPDATE tickets SET status = 'backlog', sprint = ?, attempts = attempts + 1, "
+            "priority = COALESCE(?, priority), "
+            "position = (SELECT COALESCE(MAX(position), 0) + 1 FROM tickets), "
+            "updated_at = datetime('now') WHERE id = ?",
+            (sprint, priority, ticket_id),
+        )
+        _log_ticket_event(conn, ticket_id, event, sprint)
+
+
+def archive_old_sprints(current_sprint: int, keep: int = MESSAGE_RETENTION_SPRINTS) -> int:
+    cutoff = current_sprint - keep
+    flush_messages()
+    conn = get_db()
+    sprints = [
+        r["sprint"]
+        for r in conn.execute(
+            "SELECT DISTINCT sprint FROM messages WHERE sprint < ? ORDER BY sprint", (cutoff,)
+        )
+    ]
+    archived = 0
+    for sprint in sprints:
+        rows = conn.execute(
+            "SELECT id, role, agent, content, sprint, created_at FROM messages "
+            "WHERE sprint = ? ORDER BY agent, id",
+            (sprint,),
+        ).fetchall()
+        by_agent = {}
+        for r in rows:
+            by_agent.setdefault(r["agent"], []).append(dict(r))
+        with conn:
+            for agent, items in by_agent.items():
+                payload = zlib.compress(json.dumps(items, ensure_ascii=False).encode("utf-8"), 9)
+                conn.execute(
+                    "INSERT OR REPLACE INTO message_archive "
+                    "(sprint, agent, first_id, last_id, count, payload) VALUES (?, ?, ?, ?, ?, ?)",
+                    (sprint, agent, items[0]["id"], items[-1]["id"], len(items), payload),
+                )
+            conn.execute("DELETE FROM messages WHERE sprint = ?", (sprint,))
+        archived += len(rows)
+    if archived:
+        log("DB", f"📦 Archived {archived} message(s) from {len(sprints)} sprint(s) before {cutoff}")
+    return archived
+
+
+def load_archived_messages(sprint: int, agent: Optional[str] = None) -> list[dict]:
+    conn = get_db()
+    query = "SELECT payload FROM message_archive WHERE sprint = ?"
+    params = [sprint]
+    if agent:
+        query += " AND agent = ?"
+        params.append(agent)
+    messages = []
+    for r in conn.execute(query + " ORDER BY first_id", params):
+        messages.extend(json.loads(zlib.decompress(r["payload"])))
+    return sorted(messages, key=lambda m: m["id"])
+
+
+def run_maintenance(current_sprint: int, keep: int = MESSAGE_RETENTION_SPRINTS):
+    archive_old_sprints(current_sprint, keep)
+    conn = get_db()
+    conn.execute("ANALYZE")
+    conn.execute("PRAGMA optimize")
+    if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+        # Switching to incremental auto-vacuum needs one full VACUUM; after
+        # that, free pages are reclaimed online without locking the file.
+        conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        conn.execute("VACUUM")
+    conn.execute("PRAGMA incremental_vacuum")
+    conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    log("DB", "🧹 Maintenance done (archive, analyze, vacuum, checkpoint)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="state.db maintenance")
+    parser.add_argument("command", choices=["maintain", "archive"])
+    parser.add_argument("--keep", type=int, default=MESSAGE_RETENTION_SPRINTS,
+                        help="number of recent sprints to keep in the messages table")
+    args = parser.parse_args()
+    init_db()
+    sprint = load_state("sprint_num", 1)
+    if args.command == "archive":
+        archive_old_sprints(sprint, args.keep)
+    else:
+        run_maintenance(sprint, args.keep)
\ No newline at end of file
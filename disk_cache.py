@@ -0,0 +1,100 @@
+import os
+import json
+import hashlib
+import tempfile
+import threading
+from typing import Optional
+from logger import log
+
+
+def cache_key(*parts) -> str:
+    payload = json.dumps(parts, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class DiskCache:
+    # JSON entries under root/<k[:2]>/<k>.json. An entry's mtime is bumped on
+    # every hit, so eviction by oldest mtime is least-recently-used.
+    def __init__(self, root: str, max_bytes: int, name: str = "cache"):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.name = name
+        self.lock = threading.Lock()
+        self.total = None
+        self.stats = {"hits": 0, "misses": 0, "writes": 0, "evictions": 0, "bytes_served": 0}
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.root, key[:2], f"{key}.json")
+
+    def _entries(self) -> list[tuple[float, str, int]]:
+        entries = []
+        for root, _, files in os.walk(self.root):
+            for fname in files:
+                if not fname.endswith(".json"):
+                    continue
+                path = os.path.join(root, fname)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, path, st.st_size))
+        return entries
+
+    def get(self, key: str) -> Optional[dict]:
+        path = self._path(key)
+        try:
+            with open(path, encoding="utf-8") as f:
+                raw = f.read()
+            value = json.loads(raw)
+            os.utime(path)
+        except (OSError, ValueError):
+            with self.lock:
+                self.stats["misses"] += 1
+            return None
+        with self.lock:
+            self.stats["hits"] += 1
+            self.stats["bytes_served"] += len(raw)
+        return value
+
+    def put(self, key: str, value: dict):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        data = json.dumps(value, ensure_ascii=False)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(data)
+        try:
+            replaced = os.path.getsize(path)
+        except OSError:
+            replaced = 0
+        os.replace(tmp, path)
+        with self.lock:
+            self.stats["writes"] += 1
+            if self.total is None:
+                self.total = sum(size for _, _, size in self._entries())
+            else:
+                self.total += len(data.encode("utf-8")) - replaced
+            if self.total > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        entries = sorted(self._entries())
+        total = sum(size for _, _, size in entries)
+        for _, path, size in entries:
+            if total <= self.max_bytes * 0.9:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            self.stats["evictions"] += 1
+        self.total = total
+        log("DB", f"🧹 {self.name}: evicted down to {total // 1024} KiB")
+
+    def report(self) -> dict:
+        with self.lock:
+            stats = dict(self.stats)
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+        return stats
\ No newline at end of file
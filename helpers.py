@@ -1,39 +1,27 @@
 import os
-import re
+import ast
 import json
+import time
+import hashlib
+import threading
 from typing import Optional
-from tools import tool_write_file, tool_exec_code
-from config import STDLIB_IMPORTS
+from collections import OrderedDict
+from tools import tool_write_file, tool_exec_code, exec_package_tests
+from venv_cache import normalize_requirements, use_venv
+from sandbox import CancelToken, warm_pool
+from modgraph import MODULE_GRAPH, analyze
+from snapshot import SNAPSHOT
+from config import (
+    STDLIB_IMPORTS,
+    TEST_RESULT_CACHE_SIZE,
+    SANDBOX_POOL_SIZE,
+    SANDBOX_TEST_MODE,
+    SANDBOX_TEST_SHARDS,
+)
 from logger import log
 
-def sort_by_dependencies(filepaths):
-    import re
-    deps = {}
-    for fpath in filepaths:
-        deps[fpath] = set()
-        try:
-            with open(fpath) as fp:
-                content = fp.read()
-            for match in re.findall(r'from \.([\w]+) import|from framework\.([\w]+) import|from src\.([\w]+) import', content):
-                dep_name = match[0] or match[1]
-                for other in filepaths:
-                    if os.path.basename(other) == f"{dep_name}.py":
-                        deps[fpath].add(other)
-        except Exception:
-            pass
-    ordered = []
-    visited = set()
-    def visit(path):
-        if path in visited:
-            return
-        visited.add(path)
-        for dep in deps.get(path, []):
-            visit(dep)
-        ordered.append(path)
-    for path in filepaths:
-        visit(path)
-    return ordered
-
+_test_results: "OrderedDict[str, dict]" = OrderedDict()
+_test_results_lock = threading.Lock()
 
 def fix_empty_blocks(code: str) -> str:
     lines = code.splitlines()
@@ -56,19 +44,20 @@ def apply_delivery(delivery: dict) -> bool:
     try:
         for file_info in delivery.get("files", []):
             tool_write_file(file_info["path"], file_info["content"])
+            MODULE_GRAPH.update(os.path.join("output", file_info["path"].lstrip("/")))
         return True
     except Exception as e:
         log("ERR", f"apply_delivery: {e}")
         return False
 
 
-def run_delivery_tests(delivery: dict) -> dict:
+def build_test_runner(delivery: dict) -> Optional[tuple[str, list[str]]]:
     test_files = [f for f in delivery.get("files", []) if "test" in f["path"] and f["path"].endswith(".py")]
     source_files = [f for f in delivery.get("files", []) if "test" not in f["path"] and f["path"].endswith(".py")]
 
     if not test_files:
-        return {"success": False, "stdout": "", "stderr": "No test file delivered — you must always include unit tests."}
-    
+        return None
+
     all_imports = []
     for f in test_files:
         lines = f["content"].splitlines()
@@ -95,13 +84,18 @@ def run_delivery_tests(delivery: dict) -> dict:
 
     delivery_paths = {f["path"] for f in source_files}
     if os.path.exists("output/framework"):
-            all_existing = []
-            for root, _, files in os.walk("output/framework"):
-                for fname in files:
-                    if fname.endswith(".py"):
-                        all_existing.append(os.path.join(root, fname))
+            all_existing = MODULE_GRAPH.closure(source_files + test_files)
+            if all_existing is None:
+                all_existing = []
+                for root, _, files in os.walk("output/framework"):
+                    for fname in files:
+                        if fname.endswith(".py"):
+                            all_existing.append(os.path.join(root, fname))
             
-            for fpath in sort_by_dependencies(all_existing):
+            ordered, cycles = MODULE_GRAPH.order(all_existing)
+            for cycle in cycles:
+                log("RUN", f"🔁 Import cycle: {' -> '.join(cycle)}")
+            for fpath in ordered:
                 rel = fpath.replace("output/", "")
                 if rel in delivery_paths:
                     continue
@@ -143,16 +137,138 @@ def run_delivery_tests(delivery: dict) -> dict:
             lines.append(line)
         combined += f"# === TEST: {f['path']} ===\n" + "\n".join(lines) + "\n\n"
 
-    combined += "\npytest.main(['-x', '-q', '--tb=short', '--no-header', '-p', 'no:cacheprovider', __file__])\n"
+    combined += "\nif __name__ == '__main__':\n    import sys\n    sys.exit(pytest.main(['-x', '-q', '--tb=short', '--no-header', '-p', 'no:cacheprovider', __file__]))\n"
+
+    return combined, test_requirements(delivery)
 
+
+def test_requirements(delivery: dict) -> list[str]:
     requirements = delivery.get("requirements", [])
     requirements = [r.strip() for r in requirements if r.strip()]
 
     for forced in ["pytest", "requests", "pydantic", "pyyaml"]:
         if forced not in requirements:
             requirements.append(forced)
+    return requirements
+
+
+def _with_imports(content: str, imports: list[str]) -> str:
+    # After the module docstring and __future__ imports, which must stay first.
+    body = ast.parse(content).body
+    i = 0
+    if body and isinstance(body[0], ast.Expr) and isinstance(body[0].value, ast.Constant) and isinstance(body[0].value.value, str):
+        i = 1
+    while i < len(body) and isinstance(body[i], ast.ImportFrom) and body[i].module == "__future__":
+        i += 1
+    lines = content.splitlines(keepends=True)
+    at = body[i - 1].end_lineno if i else 0
+    head = "".join(lines[:at])
+    if head and not head.endswith("\n"):
+        head += "\n"
+    return head + "".join(f"{line}\n" for line in imports) + "".join(lines[at:])
+
+
+def build_test_package(delivery: dict) -> Optional[tuple[dict[str, str], list[str], list[str]]]:
+    """Files for a real package layout: output/framework overlaid with the delivery.
+
+    Generated code relies on the inlining runner and uses framework names
+    without importing them, so the matching imports are added to each module.
+    """
+    delivered = {f["path"].lstrip("/"): f["content"] for f in delivery.get("files", [])}
+    tests = sorted(p for p in delivered if "test" in p and p.endswith(".py"))
+    if not tests:
+        return None
+
+    entries = SNAPSHOT.entries()
+    files, infos = {}, {}
+    for path, info in MODULE_GRAPH.modules().items():
+        rel = os.path.relpath(path, SNAPSHOT.root)
+        if rel.startswith("framework" + os.sep) and rel not in delivered and path in entries:
+            files[rel] = entries[path][1]
+            infos[rel] = info
+    for rel, content in delivered.items():
+        files[rel] = content
+        if rel.endswith(".py"):
+            info = analyze(os.path.join(SNAPSHOT.root, rel), content)
+            if info["ok"]:
+                infos[rel] = info
+
+    definers = {}
+    for rel in sorted(infos):
+        if rel.startswith("framework" + os.sep):
+            for name in infos[rel]["defines"]:
+                definers.setdefault(name, infos[rel]["module"])
+
+    for rel, info in infos.items():
+        wanted = {}
+        for name in sorted(info["free"]):
+            module = definers.get(name)
+            if module and module != info["module"]:
+                wanted.setdefault(module, []).append(name)
+        if wanted:
+            imports = [f"from {module} import {', '.join(names)}" for module, names in sorted(wanted.items())]
+            files[rel] = _with_imports(files[rel], imports)
+
+    return files, tests, test_requirements(delivery)
+
+
+def test_cache_key(runner: str, requirements: list[str]) -> str:
+    payload = runner + "\0" + "\n".join(normalize_requirements(requirements))
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def prepare_test_env(requirements: list[str]):
+    """Builds the venv (and a pool worker) a delivery's tests will need."""
+    requirements = test_requirements({"requirements": requirements})
+    start = time.monotonic()
+    try:
+        with use_venv(requirements) as venv_dir:
+            if SANDBOX_POOL_SIZE > 0:
+                warm_pool(venv_dir)
+    except Exception as e:
+        # The test run reports dependency and sandbox errors itself.
+        log("RUN", f"⚠️  Sandbox prep failed early: {str(e)[:200]}")
+        return
+    log("RUN", f"🔥 Sandbox ready for {', '.join(requirements)} in {time.monotonic() - start:.1f}s")
+
+
+def run_delivery_tests(delivery: dict, cancel: CancelToken = None) -> dict:
+    package = SANDBOX_TEST_MODE == "package"
+    built = build_test_package(delivery) if package else build_test_runner(delivery)
+    if built is None:
+        return {"success": False, "stdout": "", "stderr": "No test file delivered — you must always include unit tests."}
+
+    if package:
+        files, tests, requirements = built
+        key = test_cache_key(json.dumps([files, tests], sort_keys=True), requirements)
+        execute = lambda: exec_package_tests(files, tests, requirements, SANDBOX_TEST_SHARDS, cancel)
+    else:
+        runner, requirements = built
+        key = test_cache_key(runner, requirements)
+        execute = lambda: tool_exec_code(runner, requirements, SANDBOX_TEST_SHARDS, cancel)
+
+    # The runner (or package) holds all the code under test, so the same
+    # input with the same requirements always produces the same outcome.
+    with _test_results_lock:
+        cached = _test_results.get(key)
+        if cached is not None:
+            _test_results.move_to_end(key)
+    if cached is not None:
+        log("RUN", f"♻️  Test result cache hit {key[:12]}, skipping sandbox run")
+        return {**cached, "cached": True}
+
+    result = execute()
+    # Timeouts (including the shard harness's) and sandbox crashes are not
+    # test results; they may well pass on the next run, so only real
+    # outcomes are remembered.
+    returncode = result.get("returncode")
+    if isinstance(returncode, int) and returncode >= 0 and not result.get("timed_out"):
+        with _test_results_lock:
+            _test_results[key] = result
+            while len(_test_results) > TEST_RESULT_CACHE_SIZE:
+                _test_results.popitem(last=False)
+    return {**result, "cached": False}
 
-    return tool_exec_code(combined, requirements)
 
 def extract_key_error(stderr: str) -> str:
     lines = stderr.splitlines()
@@ -162,86 +278,4 @@ def extract_key_error(stderr: str) -> str:
             continue
         if any(x in line for x in ["Error", "Exception", "ModuleNotFound", "NameError", "SyntaxError", "IndentationError", "Traceback", "line "]):
             key_lines.append(line)
-    return "\n".join(key_lines[-10:]) if key_lines else stderr[-500:]
-
-
-def extract_json(text: str) -> Optional[dict]:
-    text = "".join(c for c in text if ord(c) >= 32 or c in "\n\r\t")
-    start = text.find("{")
-    if start == -1:
-        return None
-
-    depth = 0
-    in_string = False
-    escape_next = False
-    end = -1
-
-    for i, c in enumerate(text[start:], start):
-        if escape_next:
-            escape_next = False
-            continue
-        if c == "\\" and in_string:
-            escape_next = True
-            continue
-        if c == '"':
-            in_string = not in_string
-            continue
-        if in_string:
-            continue
-        if c == "{":
-            depth += 1
-        elif c == "}":
-            depth -= 1
-            if depth == 0:
-                end = i
-                break
-
-    if end == -1:
-        return None
-
-    candidate = text[start : end + 1]
-
-    try:
-        return json.loads(candidate)
-    except json.JSONDecodeError:
-        pass
-
-    try:
-        return json.loads(candidate.encode("utf-8", errors="replace").decode("utf-8"))
-    except json.JSONDecodeError as e:
-        log("ERR", f"JSON parse error final: {e}")
-        return None
-
-
-def extract_delivery(text: str) -> Optional[dict]:
-    try:
-        delivery_match = re.search(r"<delivery>(.*?)</delivery>", text, re.DOTALL)
-        if not delivery_match:
-            return None
-
-        content = delivery_match.group(1)
-
-        ticket_id = re.search(r"<ticket_id>(.*?)</ticket_id>", content)
-        requirements = re.search(r"<requirements>(.*?)</requirements>", content)
-        files = re.findall(r'<file path="([^"]+)">(.*?)</file>', content, re.DOTALL)
-
-        cleaned_files = []
-        for path, file_content in files:
-            file_content = re.sub(r'```\w*', '', file_content)
-            file_content = file_content.strip()
-            cleaned_files.append({"path": path.strip(), "content": file_content.strip()})
-
-
-        return {
-            "type": "code_delivery",
-            "ticket_id": ticket_id.group(1).strip() if ticket_id else "",
-            "requirements": (
-                [r.strip() for r in requirements.group(1).split(",")]
-                if requirements
-                else []
-            ),
-            "files": cleaned_files,
-        }
-    except Exception as e:
-        log("ERR", f"extract_delivery error: {e}")
-        return None
\ No newline at end of file
+    return "\n".join(key_lines[-10:]) if key_lines else stderr[-500:]
\ No newline at end of file
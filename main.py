@@ -1,39 +1,80 @@
 import os
 import json
 import time
+import signal
+import asyncio
+from typing import Optional
+from concurrent.futures import ThreadPoolExecutor
 from agents import (
     ceo_action,
-    coder_action,
+    acoder_action,
     tester_action
 )
-from config import MAX_CODER_ATTEMPTS, SPRINT_SIZE
-from helpers import apply_delivery, run_delivery_tests, extract_key_error, extract_delivery, extract_json
-from tools import tool_list_files, tool_read_file, tool_list_files
-from database import init_db, load_state, save_state
+from config import (
+    MAX_CODER_ATTEMPTS,
+    SPRINT_SIZE,
+    SPRINT_WORKERS,
+    CODER_CANDIDATES,
+    CODER_CANDIDATES_ON_RETRY,
+    CODER_CONTEXT_TOKENS,
+    MAINTENANCE_EVERY_SPRINTS,
+    TEST_WORKERS,
+)
+from helpers import (
+    apply_delivery,
+    prepare_test_env,
+    run_delivery_tests,
+    extract_key_error,
+)
+from parsing import DeliveryStreamParser, extract_delivery, extract_json
+from sandbox import CancelToken
+from tools import tool_list_files
+from context import select_context, log_prompt_sections
+from database import (
+    init_db,
+    load_state,
+    save_state,
+    run_maintenance,
+    add_tickets,
+    next_tickets,
+    count_tickets,
+    complete_ticket,
+    requeue_ticket,
+    flush_messages,
+)
 from logger import log
 
-def process_ticket(ticket: dict, sprint_num: int) -> bool:
+TEST_EXECUTOR = ThreadPoolExecutor(max_workers=TEST_WORKERS, thread_name_prefix="delivery-tests")
+
+
+def process_ticket(ticket: dict, sprint_num: int, apply: bool = True) -> Optional[dict]:
     ticket_id = ticket["id"]
     log("CEO", f"📋 Processing ticket {ticket_id}: {ticket['title']}")
 
-    existing_files = tool_list_files()
-    existing_code = ""
-    for filepath in existing_files.split("\n"):
-        if filepath.strip():
-            content = tool_read_file(filepath.replace("output/", ""))
-            existing_code += f"\n### {filepath}\n```python\n{content}\n```\n"
+    existing_code, context_stats = select_context(ticket, CODER_CONTEXT_TOKENS)
+    log(
+        "CODER",
+        f"🗂️  Context: {context_stats['full']} full, {context_stats['outline']} outlined, "
+        f"{context_stats['skipped']} listed only ({context_stats['tokens']}/{CODER_CONTEXT_TOKENS} tokens)",
+    )
 
-        coder_prompt = f"""Ticket to implement:
+    ticket_section = f"""Ticket to implement:
 ID: {ticket_id}
 Title: {ticket['title']}
 Description: {ticket['description']}
 Acceptance criteria: {json.dumps(ticket.get('acceptance_criteria', []))}
+"""
+    instructions = """Produce only new or modified files.
+IMPORTANT: In your test files, NEVER import from framework/ or local modules."""
 
-EXISTING CODEBASE (don't overwrite, extend only):
+    coder_prompt = f"""{ticket_section}
+EXISTING CODEBASE (don't overwrite, extend only; files marked "outline only" exist in full on disk):
 {existing_code}
 
-Produce only new or modified files.
-IMPORTANT: In your test files, NEVER import from framework/ or local modules."""
+{instructions}"""
+    log_prompt_sections(
+        {"ticket": ticket_section, "codebase": existing_code, "instructions": instructions}
+    )
 
     error_context = ""
 
@@ -46,59 +87,193 @@ IMPORTANT: In your test files, NEVER import from framework/ or local modules."""
                 f"\n\n⚠️ ERRORS to fix (previous attempt):\n{error_context}"
             )
 
-        response = coder_action(prompt, sprint_num)
-        delivery = extract_delivery(response)
-        print(response)
-
-        if not delivery or not delivery.get("files"):
-            log("ERR", f"Empty delivery or no files!")
-            error_context = "You delivered no files. You MUST deliver code in <file> tags."
-            continue 
-
-        if not delivery or delivery.get("type") != "code_delivery":
-            log("ERR", f"Invalid Coder response for {ticket_id}")
-            error_context = f"Your response was not in the expected XML <delivery> format. Response received: {response[:500]}"
-            continue
+        candidates = CODER_CANDIDATES if attempt == 1 or CODER_CANDIDATES_ON_RETRY else 1
+        outcome = asyncio.run(
+            race_candidates(prompt, ticket_id, attempt, sprint_num, max(candidates, 1))
+        )
 
-        log("CODER", f"📦 Delivery received: {len(delivery.get('files', []))} file(s)")
+        if outcome.get("delivery"):
+            if apply:
+                apply_delivery(outcome["delivery"])
+            return outcome["delivery"]
+        error_context = outcome["error"]
 
-        test_result = run_delivery_tests(delivery)
+    log("ERR", f"💀 {ticket_id} failed after {MAX_CODER_ATTEMPTS} attempts")
+    return None
+
+
+def delivery_watcher(ticket_id: str):
+    # Requirements come before the files, so the sandbox can be prepared
+    # while the rest of the delivery is still being generated.
+    parser = DeliveryStreamParser()
+    prepared = set()
+
+    def on_delta(delta: str):
+        for kind, value in parser.feed(delta):
+            if kind == "requirements":
+                key = tuple(value)
+                if key not in prepared:
+                    prepared.add(key)
+                    log("CODER", f"📥 {ticket_id} requirements known: {', '.join(r for r in value if r) or 'none'}")
+                    TEST_EXECUTOR.submit(prepare_test_env, value)
+            elif kind == "file":
+                log("CODER", f"📄 {ticket_id} file received: {value['path']} ({len(value['content'])} chars)")
+
+    return on_delta
+
+
+async def run_candidate(prompt: str, ticket_id: str, attempt: int, sprint_num: int) -> dict:
+    response = await acoder_action(prompt, sprint_num, on_delta=delivery_watcher(ticket_id))
+    delivery = extract_delivery(response)
+    print(response)
+
+    if not delivery or not delivery.get("files"):
+        log("ERR", f"Empty delivery or no files!")
+        return {"error": "You delivered no files. You MUST deliver code in <file> tags."}
+
+    if not delivery or delivery.get("type") != "code_delivery":
+        log("ERR", f"Invalid Coder response for {ticket_id}")
+        return {"error": f"Your response was not in the expected XML <delivery> format. Response received: {response[:500]}"}
+
+    log("CODER", f"📦 Delivery received: {len(delivery.get('files', []))} file(s)")
+
+    loop = asyncio.get_running_loop()
+    cancel = CancelToken()
+    try:
+        test_result = await loop.run_in_executor(TEST_EXECUTOR, run_delivery_tests, delivery, cancel)
+    except asyncio.CancelledError:
+        # Cancelling the await leaves the executor thread running; kill the
+        # sandbox job so a losing candidate frees its worker.
+        cancel.cancel()
+        raise
+
+    if test_result["success"]:
+        log("CODER", f"✅ Tests OK for {ticket_id}")
+        return {"delivery": delivery}
+
+    log("ERR", f"❌ Tests KO for {ticket_id} (attempt {attempt})")
+    key_error = extract_key_error(test_result['stderr'])
+    if test_result.get("cached"):
+        log("ERR", f"🔁 {ticket_id} attempt {attempt} is identical to an earlier failed delivery")
+        return {"error": f"""Your delivery is IDENTICAL to a previous attempt that already failed with this error:
+{key_error}
 
-        if test_result["success"]:
-            log("CODER", f"✅ Tests OK for {ticket_id}")
-            apply_delivery(delivery)
-            return True
-        else:
-            log("ERR", f"❌ Tests KO for {ticket_id} (attempt {attempt})")
-            key_error = extract_key_error(test_result['stderr'])
-            error_context = f"""PRECISE ERROR to fix:
+INSTRUCTION: Resubmitting the same code cannot pass. You MUST change the code
+(or the <requirements>) to fix the error above.
+"""}
+    log("ERR", f"stderr: {test_result['stderr']}")
+    return {"error": f"""PRECISE ERROR to fix:
 {key_error}
 
 INSTRUCTION: Fix ONLY the error above.
 - If it's a missing module → add it ONLY in <requirements>, don't touch the code
 - If it's an error on a line → fix ONLY that line in the file concerned
 - Rewrite the complete file ONLY if the fix touches multiple places
-"""
-            log("ERR", f"stderr: {test_result['stderr']}")
+"""}
+
+
+async def race_candidates(prompt: str, ticket_id: str, attempt: int, sprint_num: int, count: int) -> dict:
+    if count == 1:
+        return await run_candidate(prompt, ticket_id, attempt, sprint_num)
+
+    log("CODER", f"🎲 Requesting {count} candidate deliveries for {ticket_id}")
+    # The suffix keeps each candidate's prompt distinct, so they are sampled
+    # (and cached) independently instead of collapsing into one response.
+    tasks = [
+        asyncio.create_task(
+            run_candidate(
+                f"{prompt}\n\n(Candidate {i}/{count}: work independently.)",
+                ticket_id,
+                attempt,
+                sprint_num,
+            )
+        )
+        for i in range(1, count + 1)
+    ]
+    first_failure = None
+    try:
+        for finished in asyncio.as_completed(tasks):
+            try:
+                outcome = await finished
+            except Exception as e:
+                log("ERR", f"Candidate for {ticket_id} crashed: {e}")
+                continue
+            if outcome.get("delivery"):
+                pending = sum(1 for t in tasks if not t.done())
+                if pending:
+                    log("CODER", f"🏁 Accepted first passing candidate, cancelling {pending} other(s)")
+                return outcome
+            first_failure = first_failure or outcome
+    finally:
+        for task in tasks:
+            task.cancel()
+    return first_failure or {"error": "All candidate deliveries failed."}
+
+
+def apply_sprint_deliveries(tickets: list, deliveries: list, results: dict):
+    touched = {}
+    for ticket, delivery in zip(tickets, deliveries):
+        ticket_id = ticket["id"]
+        if not delivery:
+            results["rejected"].append(ticket_id)
+            continue
 
-    log("ERR", f"💀 {ticket_id} failed after {MAX_CODER_ATTEMPTS} attempts")
-    return False
+        paths = {f["path"].lstrip("/"): f["content"] for f in delivery.get("files", [])}
+        conflicts = []
+        for path, content in paths.items():
+            if path not in touched:
+                continue
+            try:
+                with open(os.path.join("output", path)) as fp:
+                    unchanged = fp.read() == content
+            except OSError:
+                unchanged = False
+            if not unchanged:
+                conflicts.append(f"{path} (also written by {touched[path]})")
+
+        if conflicts:
+            log("ERR", f"⚔️  {ticket_id} conflicts on {', '.join(conflicts)}, requeued")
+            results["requeued"].append(ticket_id)
+            continue
+
+        if touched:
+            log("CODER", f"🔁 Re-validating {ticket_id} against this sprint's changes")
+            test_result = run_delivery_tests(delivery)
+            if not test_result["success"]:
+                log("ERR", f"❌ {ticket_id} no longer passes after this sprint's changes, requeued")
+                results["requeued"].append(ticket_id)
+                continue
+
+        apply_delivery(delivery)
+        for path in paths:
+            touched[path] = ticket_id
+        results["approved"].append(ticket_id)
 
 
 def run_sprint(sprint_num: int, tickets: list) -> dict:
     log("CEO", f"🏃 Start Sprint {sprint_num} - {len(tickets)} tickets")
-    results = {"approved": [], "rejected": []}
-
-    for ticket in tickets:
-        success = process_ticket(ticket, sprint_num)
-        if success:
-            results["approved"].append(ticket["id"])
-        else:
-            results["rejected"].append(ticket["id"])
+    results = {"approved": [], "rejected": [], "requeued": []}
+
+    workers = min(SPRINT_WORKERS, len(tickets))
+    if workers > 1:
+        log("CEO", f"⚡ Running {len(tickets)} tickets on {workers} workers")
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="ticket") as pool:
+            deliveries = list(
+                pool.map(lambda t: process_ticket(t, sprint_num, apply=False), tickets)
+            )
+        apply_sprint_deliveries(tickets, deliveries, results)
+    else:
+        for ticket in tickets:
+            success = process_ticket(ticket, sprint_num)
+            if success:
+                results["approved"].append(ticket["id"])
+            else:
+                results["rejected"].append(ticket["id"])
 
     log(
         "CEO",
-        f"📊 Sprint {sprint_num} completed - ✅ {len(results['approved'])} / ❌ {len(results['rejected'])}",
+        f"📊 Sprint {sprint_num} completed - ✅ {len(results['approved'])} / ❌ {len(results['rejected'])}"
+        + (f" / 🔁 {len(results['requeued'])}" if results["requeued"] else ""),
     )
     return results
 
@@ -136,16 +311,21 @@ Propose concrete user stories based on your real frustrations.""",
     return []
 
 
+def handle_sigterm(signum, frame):
+    # Raising SystemExit runs atexit hooks, which flush the message journal
+    # before watcher.py restarts us.
+    raise SystemExit(128 + signum)
+
+
 def main():
     log("WATCH", "🚀 Starting autonomous agentic system")
+    signal.signal(signal.SIGTERM, handle_sigterm)
     init_db()
     os.makedirs("output", exist_ok=True)
 
     sprint_num = load_state("sprint_num", 1)
-    backlog = load_state("backlog", [])
-    done = load_state("done", [])
 
-    if not backlog:
+    if not count_tickets("backlog"):
         log("CEO", "🎯 Generating initial backlog...")
         response = ceo_action(
             """Generate the initial backlog to build a minimalist Python agentic framework.
@@ -156,11 +336,10 @@ Generate 6 to 8 prioritized user stories (priority 1 = most important).""",
         )
         data = extract_json(response)
         if data and data.get("type") == "backlog":
-            backlog = data["items"]
-            save_state("backlog", backlog)
+            backlog = add_tickets(data["items"])
             log("CEO", f"📝 Backlog created: {len(backlog)} user stories")
             for us in backlog:
-                log("CEO", f"  [{us['priority']}] {us['id']}: {us['title']}")
+                log("CEO", f"  [{us.get('priority', 99)}] {us['id']}: {us.get('title', '')}")
         else:
             log(
                 "ERR",
@@ -169,11 +348,12 @@ Generate 6 to 8 prioritized user stories (priority 1 = most important).""",
             return
 
     while True:
+        backlog_size = count_tickets("backlog")
         log("CEO", f"\n{'='*50}")
-        log("CEO", f"📅 SPRINT {sprint_num} - Remaining backlog: {len(backlog)} tickets")
+        log("CEO", f"📅 SPRINT {sprint_num} - Remaining backlog: {backlog_size} tickets")
         log("CEO", f"{'='*50}")
 
-        if not backlog:
+        if not backlog_size:
             log(
                 "CEO", "🎉 Empty backlog! The Tester is reviewing the entire framework..."
             )
@@ -183,16 +363,14 @@ Generate 6 to 8 prioritized user stories (priority 1 = most important).""",
                     s.setdefault("id", f"TS-{sprint_num}-{tester_stories.index(s)+1}")
                     s.setdefault("priority", 2)
                     s.setdefault("acceptance_criteria", [])
-                backlog.extend(tester_stories)
-                save_state("backlog", backlog)
+                add_tickets(tester_stories, sprint_num)
                 log("CEO", f"📝 {len(tester_stories)} new stories from Tester")
             else:
                 log("CEO", "⏸️  No new stories, pause 60s...")
                 time.sleep(60)
             continue
 
-        sorted_backlog = sorted(backlog, key=lambda x: x.get("priority", 99))
-        sprint_tickets = sorted_backlog[:SPRINT_SIZE]
+        sprint_tickets = next_tickets(SPRINT_SIZE)
 
         log("CEO", f"📋 Planning Sprint {sprint_num}:")
         for t in sprint_tickets:
@@ -201,18 +379,16 @@ Generate 6 to 8 prioritized user stories (priority 1 = most important).""",
         sprint_results = run_sprint(sprint_num, sprint_tickets)
 
         approved_ids = set(sprint_results["approved"])
-        done.extend([t for t in sprint_tickets if t["id"] in approved_ids])
-        backlog = [
-            t for t in backlog if t["id"] not in {x["id"] for x in sprint_tickets}
-        ]
-
+        requeued_ids = set(sprint_results["requeued"])
         for ticket in sprint_tickets:
-            if ticket["id"] not in approved_ids:
-                ticket["priority"] = 99
-                backlog.append(ticket)
+            if ticket["id"] in approved_ids:
+                complete_ticket(ticket["id"], sprint_num)
+            elif ticket["id"] in requeued_ids:
+                requeue_ticket(ticket["id"], sprint_num, event="requeued")
+            else:
+                requeue_ticket(ticket["id"], sprint_num, priority=99)
 
-        save_state("backlog", backlog)
-        save_state("done", done)
+        flush_messages()
         save_state("sprint_num", sprint_num + 1)
 
         if sprint_num % 4 == 0:
@@ -222,8 +398,7 @@ Generate 6 to 8 prioritized user stories (priority 1 = most important).""",
                     s.setdefault("id", f"TS-{sprint_num}-{tester_stories.index(s)+1}")
                     s.setdefault("priority", 3)
                     s.setdefault("acceptance_criteria", [])
-                backlog.extend(tester_stories)
-                save_state("backlog", backlog)
+                add_tickets(tester_stories, sprint_num)
                 log(
                     "CEO",
                     f"📝 {len(tester_stories)} stories from Tester added to backlog",
@@ -234,8 +409,9 @@ Generate 6 to 8 prioritized user stories (priority 1 = most important).""",
             f"""Sprint {sprint_num} completed.
 Approved: {sprint_results['approved']}
 Rejected: {sprint_results['rejected']}
+Requeued after conflicts: {sprint_results['requeued']}
 Files in codebase: {tool_list_files()}
-Remaining backlog: {len(backlog)} tickets
+Remaining backlog: {count_tickets("backlog")} tickets
 Do the sprint review. If you want to inspect code, use read_file.
 Generate new user stories if you identify gaps.
 Format: {{"type": "review", "approved": [...], "rejected": [...], "new_stories": [...], "framework_complete": false, "completion_reason": ""}}""",
@@ -243,13 +419,14 @@ Format: {{"type": "review", "approved": [...], "rejected": [...], "new_stories":
         )
         review_data = extract_json(review_response)
         if review_data and review_data.get("new_stories"):
-            new_stories = review_data["new_stories"]
-            backlog.extend(new_stories)
-            save_state("backlog", backlog)
+            new_stories = add_tickets(review_data["new_stories"], sprint_num)
             log("CEO", f"📝 {len(new_stories)} new user stories after CEO review")
         if review_data and review_data.get("framework_complete"):
             log("CEO", f"🏁 Framework complete: {review_data.get('completion_reason', '')}")
             break
+        if sprint_num % MAINTENANCE_EVERY_SPRINTS == 0:
+            run_maintenance(sprint_num)
+        flush_messages()
         sprint_num += 1
         save_state("sprint_num", sprint_num)
         log("CEO", f"😴 Pause 5s before next sprint...")
@@ -0,0 +1,261 @@
+import os
+import ast
+import builtins
+import threading
+from typing import Optional
+from snapshot import SNAPSHOT
+from logger import log
+
+FRAMEWORK_DIR = os.path.join(SNAPSHOT.root, "framework")
+BUILTIN_NAMES = set(dir(builtins))
+
+
+def module_name(path: str) -> str:
+    rel = os.path.relpath(path, SNAPSHOT.root)
+    name = rel[:-3] if rel.endswith(".py") else rel
+    parts = name.split(os.sep)
+    if parts[-1] == "__init__":
+        parts = parts[:-1]
+    return ".".join(parts)
+
+
+def imports_of(tree: ast.Module, module: str, is_package: bool) -> set[str]:
+    found = set()
+    package = module if is_package else module.rpartition(".")[0]
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            found.update(alias.name for alias in node.names)
+        elif isinstance(node, ast.ImportFrom):
+            if node.level:
+                base = package.split(".") if package else []
+                base = base[: len(base) - (node.level - 1)] if node.level > 1 else base
+                prefix = ".".join(base + ([node.module] if node.module else []))
+            else:
+                prefix = node.module or ""
+            if prefix.startswith("src."):
+                prefix = "framework." + prefix[4:]
+            found.add(prefix)
+            found.update(f"{prefix}.{alias.name}" for alias in node.names)
+    return found
+
+
+def _bindings(tree: ast.Module) -> tuple[set[str], set[str]]:
+    # Top-level definitions are what other modules can rely on; every name
+    # bound anywhere is excluded from the free names.
+    defines, bound = set(), set()
+    for node in tree.body:
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            defines.add(node.name)
+        elif isinstance(node, (ast.Assign, ast.AnnAssign, ast.AugAssign)):
+            targets = node.targets if isinstance(node, ast.Assign) else [node.target]
+            for target in targets:
+                defines.update(n.id for n in ast.walk(target) if isinstance(n, ast.Name))
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Name) and not isinstance(node.ctx, ast.Load):
+            bound.add(node.id)
+        elif isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            bound.add(node.name)
+        elif isinstance(node, ast.arg):
+            bound.add(node.arg)
+        elif isinstance(node, (ast.Import, ast.ImportFrom)):
+            for alias in node.names:
+                bound.add((alias.asname or alias.name).split(".")[0])
+        elif isinstance(node, ast.ExceptHandler) and node.name:
+            bound.add(node.name)
+        elif isinstance(node, (ast.Global, ast.Nonlocal)):
+            bound.update(node.names)
+    return defines, bound | defines
+
+
+def analyze(path: str, content: str) -> dict:
+    info = {"path": path, "module": module_name(path), "imports": set(), "defines": set(), "free": set(), "ok": True}
+    try:
+        tree = ast.parse(content)
+    except (SyntaxError, ValueError):
+        info["ok"] = False
+        return info
+    info["imports"] = imports_of(tree, info["module"], path.endswith("__init__.py"))
+    info["defines"], bound = _bindings(tree)
+    loaded = {n.id for n in ast.walk(tree) if isinstance(n, ast.Name) and isinstance(n.ctx, ast.Load)}
+    info["free"] = loaded - bound - BUILTIN_NAMES
+    return info
+
+
+def _resolve(name: str, by_module: dict[str, str]) -> Optional[str]:
+    # Bare names may be written relative to framework/, but must not fall
+    # back to the framework package itself (e.g. "os" -> "framework").
+    for candidate, floor in ((name, 1), (f"framework.{name}", 2)):
+        parts = candidate.split(".")
+        while len(parts) >= floor:
+            path = by_module.get(".".join(parts))
+            if path:
+                return path
+            parts.pop()
+    return None
+
+
+class ModuleGraph:
+    """Import graph of the Python files in the codebase snapshot.
+
+    Each file is analyzed once per content hash; resolved edges are rebuilt
+    only when a file is added, changed or removed.
+    """
+
+    def __init__(self, snapshot=SNAPSHOT):
+        self.snapshot = snapshot
+        self.nodes: dict[str, tuple[str, dict]] = {}
+        self.edges: Optional[dict[str, set[str]]] = None
+        self.lock = threading.RLock()
+
+    def _set(self, path: str, digest: str, content: str) -> bool:
+        cached = self.nodes.get(path)
+        if cached and cached[0] == digest:
+            return False
+        self.nodes[path] = (digest, analyze(path, content))
+        self.edges = None
+        return True
+
+    def update(self, path: str):
+        path = os.path.normpath(path)
+        if not path.endswith(".py"):
+            return
+        entry = self.snapshot.entry(path)
+        with self.lock:
+            if entry is None:
+                if self.nodes.pop(path, None) is not None:
+                    self.edges = None
+            elif self._set(path, *entry):
+                log("RUN", f"🧩 Module graph updated: {self.nodes[path][1]['module']}")
+
+    def sync(self):
+        entries = {p: v for p, v in self.snapshot.entries().items() if p.endswith(".py")}
+        with self.lock:
+            for path in set(self.nodes) - set(entries):
+                del self.nodes[path]
+                self.edges = None
+            for path, (digest, content) in entries.items():
+                self._set(path, digest, content)
+
+    def modules(self) -> dict[str, dict]:
+        self.sync()
+        with self.lock:
+            return {path: info for path, (_, info) in self.nodes.items()}
+
+    def _edges(self) -> dict[str, set[str]]:
+        if self.edges is None:
+            by_module = {info["module"]: path for path, (_, info) in self.nodes.items()}
+            edges = {}
+            for path, (_, info) in self.nodes.items():
+                deps = {_resolve(name, by_module) for name in info["imports"]}
+                deps.discard(None)
+                deps.discard(path)
+                edges[path] = deps
+            self.edges = edges
+        return self.edges
+
+    def dependency_map(self) -> dict[str, set[str]]:
+        self.sync()
+        with self.lock:
+            return {path: set(deps) for path, deps in self._edges().items()}
+
+    def order(self, paths: list[str]) -> tuple[list[str], list[list[str]]]:
+        """Dependencies-first order of paths, plus the import cycles among them.
+
+        Iterative Tarjan: strongly connected components come out after every
+        component they depend on. Members of a cycle are kept in path order.
+        """
+        self.sync()
+        wanted = set(paths)
+        with self.lock:
+            edges = self._edges()
+            graph = {p: sorted(d for d in edges.get(p, ()) if d in wanted) for p in wanted}
+
+        index, low, on_stack = {}, {}, set()
+        stack, ordered, cycles = [], [], []
+        for root in sorted(graph):
+            if root in index:
+                continue
+            work = [(root, iter(graph[root]))]
+            index[root] = low[root] = len(index)
+            stack.append(root)
+            on_stack.add(root)
+            while work:
+                node, deps = work[-1]
+                for dep in deps:
+                    if dep not in index:
+                        index[dep] = low[dep] = len(index)
+                        stack.append(dep)
+                        on_stack.add(dep)
+                        work.append((dep, iter(graph[dep])))
+                        break
+                    if dep in on_stack:
+                        low[node] = min(low[node], index[dep])
+                else:
+                    work.pop()
+                    if work:
+                        parent = work[-1][0]
+                        low[parent] = min(low[parent], low[node])
+                    if low[node] == index[node]:
+                        component = []
+                        while True:
+                            member = stack.pop()
+                            on_stack.discard(member)
+                            component.append(member)
+                            if member == node:
+                                break
+                        component.sort()
+                        if len(component) > 1:
+                            cycles.append(component)
+                        ordered.extend(component)
+        return ordered, cycles
+
+    def closure(self, files: list[dict]) -> Optional[list[str]]:
+        """Existing framework files reachable from the delivered files.
+
+        Follows imports and, since the runner strips local imports, also
+        top-level names that a file uses without defining. Returns None when a
+        delivered file cannot be parsed, in which case the caller should
+        include everything.
+        """
+        self.sync()
+        replaced = {os.path.normpath(os.path.join(self.snapshot.root, f["path"].lstrip("/"))) for f in files}
+        with self.lock:
+            edges = self._edges()
+            modules = {
+                path: info
+                for path, (_, info) in self.nodes.items()
+                if path.startswith(FRAMEWORK_DIR + os.sep) and path not in replaced
+            }
+        by_module = {info["module"]: path for path, info in modules.items()}
+        definers: dict[str, set[str]] = {}
+        for path, info in modules.items():
+            for name in info["defines"]:
+                definers.setdefault(name, set()).add(path)
+
+        pending = []
+        for f in files:
+            info = analyze(os.path.join(self.snapshot.root, f["path"].lstrip("/")), f["content"])
+            if not info["ok"]:
+                log("RUN", f"⚠️  Could not parse {f['path']}, inlining the whole framework")
+                return None
+            pending.append({_resolve(name, by_module) for name in info["imports"]} | self._defined_by(info, definers))
+
+        needed = set()
+        while pending:
+            for dep in pending.pop():
+                if dep in modules and dep not in needed:
+                    needed.add(dep)
+                    pending.append(edges.get(dep, set()) | self._defined_by(modules[dep], definers))
+
+        log("RUN", f"🧩 Runner scope: {len(needed)}/{len(modules)} existing framework module(s)")
+        return sorted(needed)
+
+    @staticmethod
+    def _defined_by(info: dict, definers: dict[str, set[str]]) -> set[str]:
+        found = set()
+        for name in info["free"]:
+            found.update(definers.get(name, ()))
+        return found
+
+
+MODULE_GRAPH = ModuleGraph()
\ No newline at end of file
@@ -0,0 +1,105 @@
+import time
+import asyncio
+import threading
+import requests
+from typing import Optional
+from email.utils import parsedate_to_datetime
+from requests.adapters import HTTPAdapter
+from config import HTTP_POOL_SIZE
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_session() -> requests.Session:
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=HTTP_POOL_SIZE)
+            _session.mount("https://", adapter)
+            _session.mount("http://", adapter)
+        return _session
+
+
+def _to_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def retry_after_seconds(headers) -> Optional[float]:
+    value = headers.get("Retry-After")
+    if value is None:
+        return None
+    seconds = _to_float(value)
+    if seconds is not None:
+        return max(seconds, 0.0)
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
+def reset_in_seconds(value) -> Optional[float]:
+    reset = _to_float(value)
+    if reset is None:
+        return None
+    # OpenRouter sends an epoch in milliseconds; accept epoch seconds and
+    # relative seconds as well.
+    if reset > 1e12:
+        return max(reset / 1000 - time.time(), 0.0)
+    if reset > 1e9:
+        return max(reset - time.time(), 0.0)
+    return max(reset, 0.0)
+
+
+class RateLimiter:
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.capacity = float(burst)
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self.lock = threading.Lock()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self) -> float:
+        with self.lock:
+            now = time.monotonic()
+            self._refill(now)
+            self.tokens -= 1
+            wait = max(self.blocked_until - now, 0.0)
+            if self.tokens < 0:
+                wait = max(wait, -self.tokens / self.rate)
+            return wait
+
+    def acquire(self):
+        wait = self.reserve()
+        if wait > 0:
+            time.sleep(wait)
+
+    async def acquire_async(self):
+        wait = self.reserve()
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    def backoff(self, seconds: float):
+        with self.lock:
+            self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+    def update_from_headers(self, headers):
+        remaining = _to_float(headers.get("X-RateLimit-Remaining"))
+        if remaining is None:
+            return
+        with self.lock:
+            self._refill(time.monotonic())
+            self.tokens = min(self.tokens, remaining)
+        if remaining <= 0:
+            reset = reset_in_seconds(headers.get("X-RateLimit-Reset"))
+            if reset:
+                self.backoff(reset)
\ No newline at end of file
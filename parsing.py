@@ -0,0 +1,437 @@
+import re
+import json
+from typing import Iterable, Iterator, Optional
+from logger import log
+
+
+def sse_deltas(lines: Iterable[str]) -> Iterator[str]:
+    """Content deltas from an OpenAI-style chat completion event stream."""
+    for line in lines:
+        if not line or not line.startswith("data:"):
+            # Blank separators and ": keep-alive" comments.
+            continue
+        data = line[5:].strip()
+        if data == "[DONE]":
+            return
+        event = json.loads(data)
+        if "error" in event:
+            raise RuntimeError(f"stream error: {event['error']}")
+        for choice in event.get("choices", []):
+            content = (choice.get("delta") or {}).get("content")
+            if content:
+                yield content
+
+
+class Tokenizer:
+    """Finds the structural tokens of a vocabulary, left to right.
+
+    Every extractor in this module is a single forward pass over the tokens
+    of its vocabulary: the text between two tokens is skipped by the regex
+    engine, not walked by Python code.
+    """
+
+    def __init__(self, *tokens: str):
+        # Longest first, so that no token is cut short by one of its prefixes.
+        ordered = sorted(tokens, key=len, reverse=True)
+        self.pattern = re.compile("|".join(re.escape(t) for t in ordered))
+
+    def find(self, text: str, pos: int = 0) -> tuple[int, str]:
+        """Position and text of the first token at or after pos, or (-1, "")."""
+        match = self.pattern.search(text, pos)
+        return (match.start(), match.group()) if match else (-1, "")
+
+
+JSON_TOKENS = Tokenizer("{", "}", '"', "\\")
+TOOL_CALL_TOKENS = Tokenizer("{", "}", '"tool_call"')
+DELIVERY_TOKENS = Tokenizer(
+    "<delivery>",
+    "</delivery>",
+    "<ticket_id>",
+    "</ticket_id>",
+    "<requirements>",
+    "</requirements>",
+    '<file path="',
+    "</file>",
+)
+# What helpers.extract_json has always discarded before parsing.
+CONTROL_RE = re.compile(r"[\x00-\x08\x0b\x0c\x0e-\x1f]")
+# What may come before a tool call object: whitespace and an opening fence.
+LEAD_RE = re.compile(r"\s*(```[\w-]*\s*)?")
+# The same, or a prefix of it cut off mid-fence while streaming.
+LEAD_PARTIAL_RE = re.compile(r"\s*(`{1,3}|```[\w-]*\s*)?")
+
+
+class JsonObjectScanner:
+    """Finds complete top-level {...} objects in text fed piece by piece.
+
+    Braces inside JSON strings are ignored, as in extract_json. Only the
+    characters of the object being scanned are kept.
+    """
+
+    def __init__(self):
+        self.depth = 0
+        self.in_string = False
+        self.escape = False
+        self.parts: list[str] = []
+
+    def feed(self, chunk: str) -> list[str]:
+        found = []
+        pos = 0
+        start = 0 if self.depth else None
+        if self.escape and chunk:
+            self.escape, pos = False, 1
+        while True:
+            i, c = JSON_TOKENS.find(chunk, pos)
+            if i == -1:
+                break
+            pos = i + 1
+            if not self.depth:
+                if c == "{":
+                    self.depth, start = 1, i
+            elif self.in_string:
+                if c == "\\":
+                    if pos == len(chunk):
+                        self.escape = True
+                    pos += 1
+                elif c == '"':
+                    self.in_string = False
+            elif c == '"':
+                self.in_string = True
+            elif c == "{":
+                self.depth += 1
+            elif c == "}":
+                self.depth -= 1
+                if not self.depth:
+                    self.parts.append(chunk[start : i + 1])
+                    found.append("".join(self.parts))
+                    self.parts, start = [], None
+        if self.depth and start is not None:
+            self.parts.append(chunk[start:])
+        return found
+
+
+class ToolCallWatcher:
+    """Stream callback that fires once a complete tool_calls batch has arrived.
+
+    Only a response that is the batch and nothing else counts: once
+    anything but whitespace or an opening ``` fence comes before the first
+    object, or that object is not a batch, it never fires. A single
+    {"tool_call": true, ...} object may be followed by more calls in the
+    same response, so it never stops the generation early either.
+    """
+
+    def __init__(self):
+        self.scanner = JsonObjectScanner()
+        self.lead = ""
+        self.started = False
+        self.done = False
+        self.call: Optional[dict] = None
+
+    def __call__(self, delta: str) -> bool:
+        if self.done:
+            return False
+        if not self.started:
+            brace = delta.find("{")
+            self.lead += delta if brace == -1 else delta[:brace]
+            if not LEAD_PARTIAL_RE.fullmatch(self.lead):
+                self.done = True
+                return False
+            if brace == -1:
+                return False
+            if not LEAD_RE.fullmatch(self.lead):
+                self.done = True
+                return False
+            self.started, delta = True, delta[brace:]
+        for text in self.scanner.feed(delta):
+            self.done = True
+            try:
+                obj = json.loads(text)
+            except json.JSONDecodeError:
+                return False
+            if isinstance(obj, dict) and isinstance(obj.get("tool_calls"), list):
+                self.call = obj
+                return True
+            return False
+        return False
+
+class DeliveryStreamParser:
+    """Incremental reader for the Coder's <delivery> format.
+
+    feed() returns ("ticket_id", str), ("requirements", list[str]) and
+    ("file", {"path", "content"}) events as soon as each element is complete,
+    cleaned the same way as helpers.extract_delivery.
+    """
+
+    FIELDS = ("ticket_id", "requirements")
+    CLOSERS = ("</ticket_id>", "</requirements>", "</file>")
+    OVERLAP = max(len(tag) for tag in CLOSERS + ("<delivery>",)) - 1
+    FILE_RE = re.compile(r'<file path="([^"]+)">(.*?)</file>', re.DOTALL)
+
+    def __init__(self):
+        # Deltas are only joined once a closing tag has arrived, and text
+        # already parsed is dropped, so each character is copied a bounded
+        # number of times. tail holds the end of the stream so that tags
+        # split across deltas are still noticed.
+        self.text = None
+        self.chunks: list[str] = []
+        self.tail = ""
+        self.pos = 0
+        self.seen: set[str] = set()
+
+    def feed(self, chunk: str) -> list[tuple[str, object]]:
+        events = []
+        window = self.tail + chunk
+        self.tail = window[-self.OVERLAP :]
+        if self.text is None:
+            found = window.find("<delivery>")
+            if found == -1:
+                return events
+            self.text = window[found + len("<delivery>") :]
+        else:
+            self.chunks.append(chunk)
+            if not any(tag in window for tag in self.CLOSERS):
+                return events
+            self.text += "".join(self.chunks)
+            self.chunks = []
+
+        for name in self.FIELDS:
+            if name in self.seen:
+                continue
+            match = re.search(f"<{name}>(.*?)</{name}>", self.text)
+            if not match:
+                continue
+            self.seen.add(name)
+            value = match.group(1)
+            if name == "requirements":
+                events.append((name, [r.strip() for r in value.split(",")]))
+            else:
+                events.append((name, value.strip()))
+
+        for match in self.FILE_RE.finditer(self.text, self.pos):
+            content = re.sub(r"```\w*", "", match.group(2)).strip()
+            events.append(("file", {"path": match.group(1).strip(), "content": content}))
+            self.pos = match.end()
+        # Fields are searched before files are consumed, so a field
+        # that precedes a parsed file has already been reported; dropping
+        # that text keeps later searches to the unparsed tail even when a
+        # field never shows up.
+        self.text, self.pos = self.text[self.pos :], 0
+        return events
+
+def _object_end(text: str, start: int) -> int:
+    # Index of the "}" closing the object opened at start, or -1. Control
+    # characters are invisible, as if they had been stripped beforehand: a
+    # backslash escapes the next visible character.
+    depth, in_string, pos, n = 0, False, start, len(text)
+    while True:
+        i, c = JSON_TOKENS.find(text, pos)
+        if i == -1:
+            return -1
+        pos = i + 1
+        if in_string:
+            if c == "\\":
+                while pos < n and CONTROL_RE.match(text, pos):
+                    pos += 1
+                pos += 1
+            elif c == '"':
+                in_string = False
+        elif c == '"':
+            in_string = True
+        elif c == "{":
+            depth += 1
+        elif c == "}":
+            depth -= 1
+            if not depth:
+                return i
+
+
+def extract_json(text: str) -> Optional[dict]:
+    """The first balanced {...} object in text, parsed, or None."""
+    start = text.find("{")
+    if start == -1:
+        return None
+    end = _object_end(text, start)
+    if end == -1:
+        return None
+
+    candidate = text[start : end + 1]
+    if CONTROL_RE.search(candidate):
+        candidate = CONTROL_RE.sub("", candidate)
+
+    try:
+        return json.loads(candidate)
+    except json.JSONDecodeError:
+        pass
+
+    try:
+        return json.loads(candidate.encode("utf-8", errors="replace").decode("utf-8"))
+    except json.JSONDecodeError as e:
+        log("ERR", f"JSON parse error final: {e}")
+        return None
+
+
+def tool_call_span(text: str) -> Optional[str]:
+    """What re.search(r'\\{.*"tool_call".*\\}', text, re.DOTALL) matches.
+
+    The match starts at the first "{" and exists once a '"tool_call"' follows
+    it; the greedy tail then runs to the last "}" of the text.
+    """
+    start, pos = -1, 0
+    while True:
+        i, token = TOOL_CALL_TOKENS.find(text, pos)
+        if i == -1:
+            return None
+        pos = i + len(token)
+        if token == "{":
+            if start == -1:
+                start = i
+        elif token == '"tool_call"' and start != -1:
+            end = text.rfind("}", pos)
+            return text[start : end + 1] if end != -1 else None
+
+
+def _unfenced(text: str) -> str:
+    # text without surrounding whitespace and ``` fences.
+    text = text.strip()
+    if text.startswith("```"):
+        text = text[LEAD_RE.match(text).end() :]
+    if text.endswith("```"):
+        text = text[:-3]
+    return text.strip()
+
+
+def _whole_objects(text: str) -> Optional[list[str]]:
+    # The top-level objects text consists of, or None if anything but
+    # whitespace lies between or around them.
+    objects, pos, n = [], 0, len(text)
+    while pos < n:
+        if text[pos] != "{":
+            return None
+        end = _object_end(text, pos)
+        if end == -1:
+            return None
+        objects.append(text[pos : end + 1])
+        pos = end + 1
+        while pos < n and text[pos].isspace():
+            pos += 1
+    return objects
+
+
+def extract_tool_calls(text: str) -> list[dict]:
+    """Tool calls in a response, as {"tool", "args"} dicts in order.
+
+    The response must be nothing but the calls, apart from whitespace and
+    ``` fences: a {"tool_calls": [...]} batch or any number of single
+    {"tool_call": true, ...} objects. JSON quoted in prose or inside a
+    <delivery> is never a call. If the objects do not parse, falls back to
+    the span tool_call_span would have matched, under the same rule.
+    """
+    if "<delivery>" in text:
+        return []
+    body = _unfenced(text)
+    calls = []
+    for candidate in _whole_objects(body) or []:
+        try:
+            obj = json.loads(CONTROL_RE.sub("", candidate))
+        except json.JSONDecodeError:
+            continue
+        if not isinstance(obj, dict):
+            continue
+        if isinstance(obj.get("tool_calls"), list):
+            calls.extend(c for c in obj["tool_calls"] if isinstance(c, dict) and c.get("tool"))
+        elif obj.get("tool_call") and obj.get("tool"):
+            calls.append(obj)
+    if calls:
+        return [{"tool": c["tool"], "args": c.get("args") or {}} for c in calls]
+
+    span = tool_call_span(body)
+    if span and span == body:
+        try:
+            obj = json.loads(span)
+        except json.JSONDecodeError:
+            return []
+        if isinstance(obj, dict) and obj.get("tool_call") and obj.get("tool"):
+            return [{"tool": obj["tool"], "args": obj.get("args") or {}}]
+    return []
+
+
+def _delivery_elements(text: str) -> Optional[tuple]:
+    # One pass over the tags of the first <delivery>...</delivery> element.
+    # Matches what these did on its content: re.search for the non-DOTALL
+    # <ticket_id>/<requirements> fields (the closing tag must be on the same
+    # line) and re.findall(r'<file path="([^"]+)">(.*?)</file>', re.DOTALL).
+    pos = 0
+    while True:
+        i, token = DELIVERY_TOKENS.find(text, pos)
+        if i == -1:
+            return None
+        pos = i + len(token)
+        if token == "<delivery>":
+            break
+
+    fields = {"ticket_id": None, "requirements": None}
+    openings = {"ticket_id": [], "requirements": []}
+    files = []
+    pending = None
+    while True:
+        i, token = DELIVERY_TOKENS.find(text, pos)
+        if i == -1:
+            return None
+        pos = i + len(token)
+        if token == "</delivery>":
+            # A file still open here has no </file> inside the element.
+            return fields["ticket_id"], fields["requirements"], files
+        if token == '<file path="':
+            if pending is None:
+                quote = text.find('"', pos)
+                if quote > pos and text.startswith(">", quote + 1):
+                    pending = (text[pos:quote], quote + 2)
+        elif token == "</file>":
+            if pending is not None and i >= pending[1]:
+                files.append((pending[0], text[pending[1] : i]))
+                pending = None
+        elif token != "<delivery>":
+            name = token.strip("</>")
+            if fields[name] is not None:
+                continue
+            if token[1] != "/":
+                openings[name].append(pos)
+            elif openings[name]:
+                # The first opening with no newline before this closing tag.
+                newline = text.rfind("\n", openings[name][0], i)
+                for start in openings[name]:
+                    if start > newline:
+                        fields[name] = text[start:i]
+                        break
+                openings[name] = []
+
+
+FENCE_RE = re.compile(r"```\w*")
+
+
+def extract_delivery(text: str) -> Optional[dict]:
+    try:
+        elements = _delivery_elements(text)
+        if elements is None:
+            return None
+        ticket_id, requirements, files = elements
+
+        cleaned_files = []
+        for path, file_content in files:
+            if "```" in file_content:
+                file_content = FENCE_RE.sub("", file_content)
+            cleaned_files.append({"path": path.strip(), "content": file_content.strip()})
+
+        return {
+            "type": "code_delivery",
+            "ticket_id": ticket_id.strip() if ticket_id is not None else "",
+            "requirements": (
+                [r.strip() for r in requirements.split(",")]
+                if requirements is not None
+                else []
+            ),
+            "files": cleaned_files,
+        }
+    except Exception as e:
+        log("ERR", f"extract_delivery error: {e}")
+        return None
\ No newline at end of file
@@ -0,0 +1,420 @@
+import os
+import sys
+import json
+import time
+import py_compile
+import importlib.util
+import queue
+import shutil
+import tempfile
+import threading
+import subprocess
+from typing import Optional
+from collections import OrderedDict
+from config import (
+    SANDBOX_POOL_SIZE,
+    SANDBOX_POOL_MAX_JOBS,
+    SANDBOX_POOL_MAX_VENVS,
+    SANDBOX_PRELOAD,
+    SANDBOX_TIMEOUT,
+    PYC_CACHE_DIR,
+)
+from logger import log
+from venv_cache import hold_venv, release_venv
+
+WORKER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "sandbox_worker.py")
+SHARD_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "sandbox_shards.py")
+WORKSPACE_DIR = "/sandbox/work"
+PYCACHE_DIR = "/sandbox/pycache"
+
+
+def bwrap_args(
+    venv_dir: str, workdir: str, ro_binds: list[str] = None, extra_args: list[str] = None
+) -> list[str]:
+    cmd = [
+        "bwrap",
+        "--ro-bind",
+        "/usr",
+        "/usr",
+        "--ro-bind",
+        "/lib",
+        "/lib",
+        "--ro-bind",
+        "/lib64",
+        "/lib64",
+        "--ro-bind",
+        "/etc/resolv.conf",
+        "/etc/resolv.conf",
+        "--ro-bind",
+        venv_dir,
+        venv_dir,
+    ]
+    for path in ro_binds or []:
+        cmd += ["--ro-bind", path, path]
+    cmd += [
+        "--bind",
+        workdir,
+        workdir,
+    ]
+    cmd += extra_args or []
+    cmd += [
+        "--proc",
+        "/proc",
+        "--dev",
+        "/dev",
+        "--unshare-pid",
+        "--die-with-parent",
+    ]
+    return cmd
+
+
+def workspace_binds(work_dir: str) -> list[str]:
+    # The workspace is mounted at a fixed path so compiled modules in the
+    # shared pyc cache stay valid whichever worker ran them. Only the host
+    # writes to that cache: a delivery must not plant bytecode for the next.
+    os.makedirs(PYC_CACHE_DIR, exist_ok=True)
+    return ["--ro-bind", work_dir, WORKSPACE_DIR, "--ro-bind", PYC_CACHE_DIR, PYCACHE_DIR]
+
+
+def shard_argv(shards: int, targets: list[str], package: bool = False) -> list[str]:
+    # Leave the harness time to kill its shards and report before the
+    # sandbox timeout kills the harness itself.
+    argv = [SHARD_SCRIPT, "--shards", str(shards), "--timeout", str(max(SANDBOX_TIMEOUT - 2, 1))]
+    if package:
+        argv += ["--rootdir", WORKSPACE_DIR, "--pythonpath", WORKSPACE_DIR, "--pycache-prefix", PYCACHE_DIR]
+    return argv + targets
+
+
+def cached_pyc(rel: str) -> str:
+    # Where the sandbox interpreter, with sys.pycache_prefix = PYCACHE_DIR,
+    # looks for the bytecode of WORKSPACE_DIR/rel.
+    source = os.path.join(WORKSPACE_DIR, rel)
+    stem = os.path.splitext(os.path.basename(source))[0]
+    return os.path.join(
+        PYC_CACHE_DIR, os.path.dirname(source).lstrip("/"), f"{stem}.{sys.implementation.cache_tag}.pyc"
+    )
+
+
+def precompile(path: str, rel: str, data: bytes):
+    """Compiles a workspace module into the pyc cache unless already there.
+
+    The .pyc embeds a hash of its source (CHECKED_HASH), which the sandbox
+    interpreter verifies on import, so stale bytecode is never used. Venvs
+    built from another Python version simply miss the cache.
+    """
+    cfile = cached_pyc(rel)
+    source_hash = importlib.util.source_hash(data)
+    try:
+        with open(cfile, "rb") as f:
+            header = f.read(16)
+        if header == importlib.util.MAGIC_NUMBER + (3).to_bytes(4, "little") + source_hash:
+            return
+    except OSError:
+        pass
+    try:
+        py_compile.compile(
+            path,
+            cfile=cfile,
+            dfile=os.path.join(WORKSPACE_DIR, rel),
+            doraise=True,
+            invalidation_mode=py_compile.PycInvalidationMode.CHECKED_HASH,
+        )
+    except py_compile.PyCompileError:
+        # pytest reports the syntax error from inside the sandbox.
+        pass
+
+
+def write_workspace(work_dir: str, files: dict[str, str]):
+    for name in os.listdir(work_dir):
+        path = os.path.join(work_dir, name)
+        if os.path.isdir(path):
+            shutil.rmtree(path, ignore_errors=True)
+        else:
+            os.remove(path)
+    for rel, content in files.items():
+        path = os.path.join(work_dir, rel)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        data = content.encode("utf-8")
+        with open(path, "wb") as f:
+            f.write(data)
+        if rel.endswith(".py"):
+            precompile(path, rel, data)
+
+
+class CancelToken:
+    """Lets another thread abort the sandbox job it was passed to.
+
+    Runners register a callback that kills their process; cancel() calls
+    it, or register() calls it at once if the token is already cancelled.
+    """
+
+    def __init__(self):
+        self.cancelled = False
+        self.callbacks = []
+        self.lock = threading.Lock()
+
+    def cancel(self):
+        with self.lock:
+            self.cancelled = True
+            callbacks, self.callbacks = self.callbacks, []
+        for callback in callbacks:
+            callback()
+
+    def register(self, callback):
+        with self.lock:
+            if not self.cancelled:
+                self.callbacks.append(callback)
+                return
+        callback()
+
+    def unregister(self, callback):
+        with self.lock:
+            if callback in self.callbacks:
+                self.callbacks.remove(callback)
+
+
+class SandboxWorker:
+    def __init__(self, venv_dir: str):
+        self.jobs = 0
+        self.jobs_dir = tempfile.mkdtemp(prefix="sandbox-worker-")
+        self.work_dir = os.path.join(self.jobs_dir, ".work")
+        os.makedirs(self.work_dir)
+        python_bin = os.path.join(venv_dir, "bin", "python3")
+        binds = workspace_binds(self.work_dir)
+        cmd = bwrap_args(venv_dir, self.jobs_dir, [WORKER_SCRIPT, SHARD_SCRIPT], binds) + [
+            python_bin,
+            WORKER_SCRIPT,
+            ",".join(SANDBOX_PRELOAD),
+        ]
+        self.proc = subprocess.Popen(
+            cmd,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            text=True,
+            cwd=self.jobs_dir,
+        )
+        ready = self._read(SANDBOX_TIMEOUT)
+        if not ready or not ready.get("ready"):
+            self.close()
+            raise RuntimeError("sandbox worker failed to start")
+
+    def alive(self) -> bool:
+        return self.proc.poll() is None
+
+    def _read(self, timeout: float):
+        # A hung worker must not hang the caller: kill it after the deadline,
+        # which turns the blocking readline into an EOF.
+        watchdog = threading.Timer(timeout, self.proc.kill)
+        watchdog.start()
+        try:
+            line = self.proc.stdout.readline()
+        finally:
+            watchdog.cancel()
+        return json.loads(line) if line else None
+
+    def run(self, argv: list[str], cwd: str, timeout: float, cancel: CancelToken = None) -> dict:
+        self.jobs += 1
+        stdout_path = os.path.join(cwd, ".stdout")
+        stderr_path = os.path.join(cwd, ".stderr")
+        job = {
+            "argv": argv,
+            "cwd": cwd,
+            "stdout": stdout_path,
+            "stderr": stderr_path,
+            "timeout": timeout,
+        }
+        self.proc.stdin.write(json.dumps(job) + "\n")
+        self.proc.stdin.flush()
+        # The worker cannot interrupt a running job, so cancelling kills it;
+        # the pool then replaces it.
+        if cancel:
+            cancel.register(self.proc.kill)
+        try:
+            result = self._read(timeout + 10)
+        finally:
+            if cancel:
+                cancel.unregister(self.proc.kill)
+        if result is None:
+            raise RuntimeError("sandbox worker crashed")
+
+        for key, path in (("stdout", stdout_path), ("stderr", stderr_path)):
+            try:
+                with open(path, errors="replace") as f:
+                    result[key] = f.read()
+            except OSError:
+                result[key] = ""
+        return result
+
+    def close(self):
+        if self.alive():
+            self.proc.kill()
+        self.proc.wait()
+        shutil.rmtree(self.jobs_dir, ignore_errors=True)
+
+
+class SandboxPool:
+    def __init__(self, venv_dir: str, size: int):
+        # Workers run from the venv for as long as the pool lives.
+        hold_venv(venv_dir)
+        self.venv_dir = venv_dir
+        self.size = size
+        self.idle = queue.Queue()
+        self.created = 0
+        self.lock = threading.Lock()
+        self.closed = False
+
+    def try_acquire(self) -> Optional[SandboxWorker]:
+        # An idle worker, a newly started one if the pool has room, or None.
+        if self.closed:
+            return None
+        try:
+            return self.idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self.lock:
+            spawn = self.created < self.size
+            if spawn:
+                self.created += 1
+        if not spawn:
+            return None
+        try:
+            return SandboxWorker(self.venv_dir)
+        except Exception:
+            with self.lock:
+                self.created -= 1
+            raise
+
+    def acquire(self, cancel: "CancelToken" = None) -> Optional[SandboxWorker]:
+        """A worker, waiting for one if all are busy.
+
+        Returns None once the pool is closed (get_pool then hands out a new
+        one) or the job is cancelled.
+        """
+        while not self.closed and not (cancel and cancel.cancelled):
+            worker = self.try_acquire()
+            if worker:
+                return worker
+            try:
+                worker = self.idle.get(timeout=0.25)
+            except queue.Empty:
+                continue
+            if self.closed:
+                self.release(worker)
+                return None
+            return worker
+        return None
+
+    def release(self, worker: SandboxWorker, crashed: bool = False):
+        # Decided once, under the lock, so close() never misses a worker put
+        # back and created drops exactly once per worker closed here.
+        with self.lock:
+            crashed = crashed or not worker.alive()
+            if not crashed and worker.jobs < SANDBOX_POOL_MAX_JOBS and not self.closed:
+                self.idle.put(worker)
+                return
+            self.created -= 1
+            closed = self.closed
+        if not closed:
+            reason = "crash" if crashed else f"{worker.jobs} jobs"
+            log("RUN", f"♻️  Recycling sandbox worker ({reason})")
+            with _stats_lock:
+                _stats["recycled"] += 1
+        worker.close()
+
+    def close(self):
+        with self.lock:
+            if self.closed:
+                return
+            self.closed = True
+        release_venv(self.venv_dir)
+        while True:
+            try:
+                worker = self.idle.get_nowait()
+            except queue.Empty:
+                break
+            worker.close()
+            with self.lock:
+                self.created -= 1
+
+
+_pools: "OrderedDict[str, SandboxPool]" = OrderedDict()
+_pools_lock = threading.Lock()
+_stats_lock = threading.Lock()
+_stats = {"jobs": 0, "crashes": 0, "recycled": 0, "wait_s": 0.0, "exec_s": 0.0}
+
+
+def get_pool(venv_dir: str) -> SandboxPool:
+    with _pools_lock:
+        pool = _pools.get(venv_dir)
+        if pool is None:
+            pool = _pools[venv_dir] = SandboxPool(venv_dir, SANDBOX_POOL_SIZE)
+        _pools.move_to_end(venv_dir)
+        while len(_pools) > SANDBOX_POOL_MAX_VENVS:
+            _, stale = _pools.popitem(last=False)
+            stale.close()
+        return pool
+
+
+def warm_pool(venv_dir: str):
+    # Starts a worker ahead of the first job if none is idle yet. Never
+    # waits: if every worker is busy, there is nothing to warm.
+    pool = get_pool(venv_dir)
+    if pool.idle.empty():
+        worker = pool.try_acquire()
+        if worker:
+            pool.release(worker)
+
+
+def pool_stats() -> dict:
+    with _stats_lock:
+        stats = dict(_stats)
+    jobs = max(stats["jobs"], 1)
+    stats["avg_wait_s"] = stats["wait_s"] / jobs
+    stats["avg_exec_s"] = stats["exec_s"] / jobs
+    return stats
+
+
+def run_in_pool(venv_dir: str, write_job, timeout: float = SANDBOX_TIMEOUT, cancel: CancelToken = None) -> dict:
+    pool = get_pool(venv_dir)
+    queued = time.monotonic()
+    cancelled = {"returncode": -1, "timed_out": False, "cancelled": True, "stdout": "", "stderr": "Cancelled"}
+
+    for attempt in range(2):
+        worker = pool.acquire(cancel)
+        while worker is None:
+            if cancel and cancel.cancelled:
+                return cancelled
+            # The pool was closed (evicted by get_pool) while we waited.
+            pool = get_pool(venv_dir)
+            worker = pool.acquire(cancel)
+        wait = time.monotonic() - queued
+        job_dir = tempfile.mkdtemp(dir=worker.jobs_dir)
+        try:
+            argv = write_job(job_dir, worker.work_dir)
+            result = worker.run(argv, job_dir, timeout, cancel)
+        except (RuntimeError, OSError) as e:
+            pool.release(worker, crashed=True)
+            if cancel and cancel.cancelled:
+                log("RUN", "🛑 Sandbox job cancelled, worker killed")
+                return cancelled
+            with _stats_lock:
+                _stats["crashes"] += 1
+            log("ERR", f"sandbox worker: {e}")
+            if attempt == 0:
+                continue
+            return {"returncode": -1, "timed_out": False, "stdout": "", "stderr": str(e)}
+        finally:
+            shutil.rmtree(job_dir, ignore_errors=True)
+
+        pool.release(worker)
+        with _stats_lock:
+            _stats["jobs"] += 1
+            _stats["wait_s"] += wait
+            _stats["exec_s"] += result["elapsed"]
+        log(
+            "RUN",
+            f"⏱️  pool wait={wait * 1000:.0f}ms exec={result['elapsed'] * 1000:.0f}ms "
+            f"(jobs={_stats['jobs']} workers={pool.created}/{pool.size})",
+        )
+        return result
\ No newline at end of file
@@ -0,0 +1,125 @@
+import os
+import sys
+import time
+import argparse
+import threading
+import subprocess
+
+# Runs inside bwrap with the sandbox venv interpreter. Collects the pytest
+# node ids of the targets, splits them round-robin across shard processes
+# and merges their output. Exits with the first failing shard's code.
+
+PYTEST_ARGS = ["-x", "-q", "--tb=short", "--no-header", "-p", "no:cacheprovider"]
+# Exit status when collection or any shard ran out of time, so callers can
+# tell a slow run from a real test result (pytest itself exits with 0-5).
+TIMEOUT_EXIT = 124
+
+
+def parse_args(argv: list[str]):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--shards", type=int, default=os.cpu_count() or 2)
+    parser.add_argument("--timeout", type=float, default=30)
+    parser.add_argument("--rootdir")
+    parser.add_argument("--pythonpath")
+    parser.add_argument("--pycache-prefix")
+    parser.add_argument("targets", nargs="+")
+    return parser.parse_args(argv)
+
+
+def shard_env(args) -> dict:
+    env = dict(os.environ)
+    if args.pythonpath:
+        env["PYTHONPATH"] = args.pythonpath
+    if args.pycache_prefix:
+        env["PYTHONPYCACHEPREFIX"] = args.pycache_prefix
+    return env
+
+
+def pytest_cmd(args, items: list[str]) -> list[str]:
+    cmd = [sys.executable, "-m", "pytest"] + PYTEST_ARGS
+    if args.rootdir:
+        cmd += ["--rootdir", args.rootdir]
+    return cmd + items
+
+
+def collect(args, env: dict) -> tuple[int, list[str], str]:
+    result = subprocess.run(
+        pytest_cmd(args, ["--collect-only"] + args.targets),
+        capture_output=True,
+        text=True,
+        env=env,
+        timeout=args.timeout,
+    )
+    node_ids = [line.strip() for line in result.stdout.splitlines() if "::" in line]
+    # Node ids are relative to the rootdir, which need not be the cwd.
+    if args.rootdir:
+        node_ids = [n if os.path.isabs(n) else os.path.join(args.rootdir, n) for n in node_ids]
+    return result.returncode, node_ids, result.stdout + result.stderr
+
+
+def main(argv: list[str]) -> int:
+    args = parse_args(argv)
+    env = shard_env(args)
+    deadline = time.monotonic() + args.timeout
+
+    try:
+        returncode, node_ids, output = collect(args, env)
+    except subprocess.TimeoutExpired:
+        print(f"Timeout during collection ({args.timeout:.0f}s exceeded)", file=sys.stderr)
+        return TIMEOUT_EXIT
+    if returncode != 0 or not node_ids:
+        sys.stdout.write(output)
+        return returncode or 5
+
+    count = max(1, min(args.shards, len(node_ids)))
+    shards = [node_ids[i::count] for i in range(count)]
+    procs = []
+    for items in shards:
+        proc = subprocess.Popen(
+            pytest_cmd(args, ["--durations=3"] + items),
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            text=True,
+            env=env,
+        )
+        procs.append((proc, time.monotonic()))
+
+    # One waiter per shard, so each one's time ends when it exits rather
+    # than when the shards before it have been drained.
+    results = [None] * count
+
+    def wait(i: int, proc: subprocess.Popen, started: float):
+        try:
+            out, _ = proc.communicate(timeout=max(deadline - time.monotonic(), 0.1))
+            timed_out = False
+        except subprocess.TimeoutExpired:
+            proc.kill()
+            out, _ = proc.communicate()
+            timed_out = True
+        results[i] = (proc.returncode, timed_out, time.monotonic() - started, out)
+
+    waiters = [
+        threading.Thread(target=wait, args=(i, proc, started), daemon=True)
+        for i, (proc, started) in enumerate(procs)
+    ]
+    for waiter in waiters:
+        waiter.start()
+    for waiter in waiters:
+        waiter.join()
+
+    final = 0
+    for i, (code, timed_out, elapsed, out) in enumerate(results, 1):
+        status = "timeout" if timed_out else f"exit {code}"
+        print(f"===== shard {i}/{count}: {len(shards[i - 1])} test(s), {elapsed:.2f}s, {status} =====")
+        sys.stdout.write(out)
+        if code and not timed_out and not final:
+            final = code
+    for i, (code, timed_out, elapsed, _) in enumerate(results, 1):
+        print(f"[shard {i}/{count}] tests={len(shards[i - 1])} time={elapsed:.2f}s exit={'timeout' if timed_out else code}")
+    if any(timed_out for _, timed_out, _, _ in results):
+        return TIMEOUT_EXIT
+    return final
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
\ No newline at end of file
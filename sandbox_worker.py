@@ -0,0 +1,101 @@
+import os
+import sys
+import json
+import time
+import runpy
+import signal
+import traceback
+
+# Runs inside bwrap with the sandbox venv interpreter. Preloads the common
+# test stack once, then forks a fresh child for every job read from stdin.
+
+
+def preload(modules: list[str]):
+    for name in modules:
+        try:
+            __import__(name)
+        except Exception:
+            pass
+
+
+def run_child(job: dict):
+    # Its own process group, so whatever the job starts can be killed with it.
+    os.setsid()
+    devnull = os.open(os.devnull, os.O_RDONLY)
+    os.dup2(devnull, 0)
+    out = os.open(job["stdout"], os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    err = os.open(job["stderr"], os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    os.dup2(out, 1)
+    os.dup2(err, 2)
+    os.chdir(job["cwd"])
+    sys.argv = list(job["argv"])
+    sys.path[0] = os.path.dirname(os.path.abspath(sys.argv[0]))
+
+    code = 0
+    try:
+        runpy.run_path(sys.argv[0], run_name="__main__")
+    except SystemExit as e:
+        if e.code is None:
+            code = 0
+        elif isinstance(e.code, int):
+            code = e.code
+        else:
+            print(e.code, file=sys.stderr)
+            code = 1
+    except BaseException:
+        traceback.print_exc()
+        code = 1
+    sys.stdout.flush()
+    sys.stderr.flush()
+    os._exit(code)
+
+
+def kill_group(pid: int):
+    try:
+        os.killpg(pid, signal.SIGKILL)
+    except OSError:
+        # Not yet a group leader: the child itself is all there is.
+        os.kill(pid, signal.SIGKILL)
+
+
+def wait_child(pid: int, timeout: float) -> tuple[int, bool]:
+    # The child is reaped only after its group has been killed: until then
+    # its zombie keeps the group id from being reused. Nothing a job leaves
+    # behind survives into the next one.
+    deadline = time.monotonic() + timeout
+    timed_out = False
+    while not os.waitid(os.P_PID, pid, os.WEXITED | os.WNOHANG | os.WNOWAIT):
+        if time.monotonic() > deadline:
+            timed_out = True
+            break
+        time.sleep(0.005)
+    kill_group(pid)
+    _, status = os.waitpid(pid, 0)
+    return os.waitstatus_to_exitcode(status), timed_out
+
+
+def main():
+    preload([m for m in sys.argv[1].split(",") if m] if len(sys.argv) > 1 else [])
+    print(json.dumps({"ready": True}), flush=True)
+
+    for line in sys.stdin:
+        job = json.loads(line)
+        start = time.monotonic()
+        pid = os.fork()
+        if pid == 0:
+            run_child(job)
+        returncode, timed_out = wait_child(pid, job["timeout"])
+        print(
+            json.dumps(
+                {
+                    "returncode": returncode,
+                    "timed_out": timed_out,
+                    "elapsed": time.monotonic() - start,
+                }
+            ),
+            flush=True,
+        )
+
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
@@ -0,0 +1,65 @@
+import os
+import hashlib
+import threading
+from typing import Optional
+
+
+class CodebaseSnapshot:
+    def __init__(self, root: str = "output"):
+        self.root = root
+        self.files: dict[str, dict] = {}
+        self.lock = threading.Lock()
+
+    def _load(self, path: str, st: os.stat_result):
+        with open(path, "r", errors="replace") as f:
+            content = f.read()
+        digest = hashlib.sha256(content.encode("utf-8", errors="replace")).hexdigest()
+        entry = self.files.get(path)
+        if entry and entry["hash"] == digest:
+            entry["mtime"], entry["size"] = st.st_mtime_ns, st.st_size
+            return
+        self.files[path] = {
+            "mtime": st.st_mtime_ns,
+            "size": st.st_size,
+            "hash": digest,
+            "content": content,
+        }
+
+    def update(self, path: str):
+        path = os.path.normpath(path)
+        with self.lock:
+            try:
+                self._load(path, os.stat(path))
+            except OSError:
+                self.files.pop(path, None)
+
+    def refresh(self):
+        with self.lock:
+            seen = set()
+            for root, _, files in os.walk(self.root):
+                for fname in files:
+                    path = os.path.join(root, fname)
+                    seen.add(path)
+                    try:
+                        st = os.stat(path)
+                        entry = self.files.get(path)
+                        if entry and entry["mtime"] == st.st_mtime_ns and entry["size"] == st.st_size:
+                            continue
+                        self._load(path, st)
+                    except OSError:
+                        continue
+            for path in set(self.files) - seen:
+                del self.files[path]
+
+    def entry(self, path: str) -> Optional[tuple[str, str]]:
+        with self.lock:
+            entry = self.files.get(os.path.normpath(path))
+            return (entry["hash"], entry["content"]) if entry else None
+
+    def entries(self) -> dict[str, tuple[str, str]]:
+        self.refresh()
+        with self.lock:
+            return {path: (entry["hash"], entry["content"]) for path, entry in self.files.items()}
+
+
+SNAPSHOT = CodebaseSnapshot("output")
\ No newline at end of file
@@ -0,0 +1,4 @@
+def estimate_tokens(text: str) -> int:
+    # ~4 characters per token for English prose and Python source; close
+    # enough for budgeting without shipping a tokenizer.
+    return (len(text) + 3) // 4
\ No newline at end of file
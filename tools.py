@@ -1,27 +1,58 @@
 import os
 import re
+import asyncio
 import subprocess
 import tempfile
 import requests
 from logger import log
+from concurrent.futures import ThreadPoolExecutor
+from config import SANDBOX_POOL_SIZE, SANDBOX_TIMEOUT, TOOL_WORKERS, WEB_FETCH_TTL, WEB_SEARCH_TTL
+from snapshot import SNAPSHOT
+from sandbox import (
+    PYCACHE_DIR,
+    SHARD_SCRIPT,
+    WORKSPACE_DIR,
+    CancelToken,
+    bwrap_args,
+    run_in_pool,
+    shard_argv,
+    workspace_binds,
+    write_workspace,
+)
+from sandbox_shards import TIMEOUT_EXIT
+from venv_cache import DependencyError, get_venv, release_venv
+from web_cache import cached_get, normalize_query, normalize_url
+
+
+def _render_search(resp: requests.Response) -> str:
+    data = resp.json()
+    results = []
+    if data.get("AbstractText"):
+        results.append(data["AbstractText"])
+    for r in data.get("RelatedTopics", [])[:5]:
+        if isinstance(r, dict) and r.get("Text"):
+            results.append(r["Text"])
+    return "\n".join(results) if results else "No results found."
+
+
+def _render_page(resp: requests.Response) -> str:
+    text = re.sub(r"<[^>]+>", " ", resp.text)
+    text = re.sub(r"\s+", " ", text).strip()
+    return text[:4000]
 
 
 def tool_web_search(query: str) -> str:
     log("TOOL", f"🔍 web_search: {query}")
     try:
-        resp = requests.get(
+        return cached_get(
+            "web_search",
+            normalize_query(query),
             "https://api.duckduckgo.com/",
+            WEB_SEARCH_TTL,
+            _render_search,
             params={"q": query, "format": "json", "no_html": 1, "skip_disambig": 1},
             timeout=10,
         )
-        data = resp.json()
-        results = []
-        if data.get("AbstractText"):
-            results.append(data["AbstractText"])
-        for r in data.get("RelatedTopics", [])[:5]:
-            if isinstance(r, dict) and r.get("Text"):
-                results.append(r["Text"])
-        return "\n".join(results) if results else "No results found."
     except Exception as e:
         return f"web_search error: {e}"
 
@@ -29,79 +60,195 @@ def tool_web_search(query: str) -> str:
 def tool_fetch_url(url: str) -> str:
     log("TOOL", f"🌐 fetch_url: {url}")
     try:
-        resp = requests.get(url, timeout=15, headers={"User-Agent": "Mozilla/5.0"})
-        text = re.sub(r"<[^>]+>", " ", resp.text)
-        text = re.sub(r"\s+", " ", text).strip()
-        return text[:4000]
+        return cached_get(
+            "fetch_url",
+            normalize_url(url),
+            url,
+            WEB_FETCH_TTL,
+            _render_page,
+            headers={"User-Agent": "Mozilla/5.0"},
+            timeout=15,
+        )
     except Exception as e:
         return f"fetch_url error: {e}"
 
 
-def tool_exec_code(code: str, requirements: list[str] = None) -> dict:
-    log("RUN", f"⚙️  Sandbox execution (bwrap)")
-    with tempfile.TemporaryDirectory() as tmpdir:
-        venv_dir = os.path.join(tmpdir, "venv")
-        code_file = os.path.join(tmpdir, "test_runner.py")
-        output_dir = os.path.join(tmpdir, "output")
-        os.makedirs(output_dir)
+def _timeout(stderr: str = "") -> dict:
+    return {
+        "success": False,
+        "timed_out": True,
+        "stdout": "",
+        "stderr": stderr or f"Timeout ({SANDBOX_TIMEOUT}s exceeded)",
+    }
+
+
+def _exec_result(
+    returncode: int, stdout: str, stderr: str, report: bool = False, sharded: bool = False
+) -> dict:
+    success = returncode in (0, )
+    log("RUN", f"{'✅' if success else '❌'} returncode={returncode}")
+    # The shard harness prints its per-shard timings last, so read them
+    # before the output is cut down.
+    for line in stdout.splitlines():
+        if line.startswith("[shard "):
+            log("RUN", f"🧮 {line}")
+    if report and not success:
+        # pytest reports failures on stdout; keep them where callers look.
+        stderr = stderr + "\n" + stdout
+    if not success:
+        log("ERR", f"stderr: {stderr}")
+    # Tracebacks and pytest summaries end the output: keep the tail.
+    return {
+        "success": success,
+        "returncode": returncode,
+        # Set when the shard harness ran out of time: not a test result.
+        # Any other script is free to exit with the same code.
+        "timed_out": sharded and returncode == TIMEOUT_EXIT,
+        "stdout": stdout[-3000:],
+        "stderr": stderr[-2000:],
+    }
+
+
+def _dependency_failure(e: DependencyError) -> dict:
+    return {
+        "success": False,
+        "stdout": "",
+        "stderr": f"Dependency installation failed, nothing was executed:\n{e}"[:2000],
+    }
+
+
+def _run_pooled(
+    venv_dir: str, write_job, report: bool = False, cancel: CancelToken = None, sharded: bool = False
+) -> dict:
+    result = run_in_pool(venv_dir, write_job, cancel=cancel)
+    if result.get("cancelled"):
+        return {"success": False, "stdout": "", "stderr": "Cancelled"}
+    if result.get("timed_out"):
+        return _timeout()
+    return _exec_result(result["returncode"], result["stdout"], result["stderr"], report, sharded)
+
+
+def _run_standalone(
+    cmd: list[str], cwd: str, report: bool = False, cancel: CancelToken = None, sharded: bool = False
+) -> dict:
+    try:
+        proc = subprocess.Popen(
+            cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, cwd=cwd
+        )
+    except Exception as e:
+        return {"success": False, "stdout": "", "stderr": str(e)}
+    if cancel:
+        cancel.register(proc.kill)
+    try:
+        stdout, stderr = proc.communicate(timeout=SANDBOX_TIMEOUT)
+    except subprocess.TimeoutExpired:
+        proc.kill()
+        proc.communicate()
+        return _timeout()
+    finally:
+        if cancel:
+            cancel.unregister(proc.kill)
+    if cancel and cancel.cancelled:
+        return {"success": False, "stdout": "", "stderr": "Cancelled"}
+    return _exec_result(proc.returncode, stdout, stderr, report, sharded)
+
+
+def tool_exec_code(
+    code: str, requirements: list[str] = None, shards: int = None, cancel: CancelToken = None
+) -> dict:
+    log("RUN", f"⚙️  Sandbox execution (bwrap{f', {shards} shards' if shards and shards > 1 else ''})")
+    try:
+        venv_dir = get_venv(requirements or [])
+    except DependencyError as e:
+        return _dependency_failure(e)
+    try:
+        return _exec_code(venv_dir, code, shards, cancel)
+    finally:
+        release_venv(venv_dir)
 
-        subprocess.run(["python3", "-m", "venv", venv_dir], capture_output=True)
-        pip = os.path.join(venv_dir, "bin", "pip")
 
-        if requirements:
-            for req in requirements:
-                log("RUN", f"📦 pip install {req}")
-                subprocess.run([pip, "install", req], capture_output=True, timeout=60)
+def _exec_code(venv_dir: str, code: str, shards: int, cancel: CancelToken) -> dict:
+    sharded = bool(shards and shards > 1)
 
+    def write_job(job_dir: str, work_dir: str = None) -> list[str]:
+        os.makedirs(os.path.join(job_dir, "output"))
+        code_file = os.path.join(job_dir, "test_runner.py")
         with open(code_file, "w") as f:
             f.write(code)
+        if sharded:
+            return shard_argv(shards, [code_file])
+        return [code_file]
 
+    if SANDBOX_POOL_SIZE > 0:
+        try:
+            return _run_pooled(venv_dir, write_job, report=True, cancel=cancel, sharded=sharded)
+        except Exception as e:
+            log("ERR", f"sandbox pool unavailable, running standalone: {e}")
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        argv = write_job(tmpdir)
         python_bin = os.path.join(venv_dir, "bin", "python3")
+        cmd = bwrap_args(venv_dir, tmpdir, [SHARD_SCRIPT]) + [python_bin] + argv
+        return _run_standalone(cmd, tmpdir, report=True, cancel=cancel, sharded=sharded)
+
+
+PACKAGE_LAUNCHER = """import sys
+sys.pycache_prefix = {pycache!r}
+sys.path.insert(0, {work!r})
+import pytest
+sys.exit(pytest.main(['-x', '-q', '--tb=short', '--no-header', '-p', 'no:cacheprovider', '--rootdir', {work!r}] + {tests!r}))
+"""
+
+
+def exec_package_tests(
+    files: dict[str, str],
+    test_paths: list[str],
+    requirements: list[str] = None,
+    shards: int = None,
+    cancel: CancelToken = None,
+) -> dict:
+    """Runs pytest on test_paths against files laid out as a real package."""
+    log("RUN", f"⚙️  Sandbox package execution ({len(files)} files, {len(test_paths)} test file(s))")
+    try:
+        venv_dir = get_venv(requirements or [])
+    except DependencyError as e:
+        return _dependency_failure(e)
+    try:
+        return _exec_package(venv_dir, files, test_paths, shards, cancel)
+    finally:
+        release_venv(venv_dir)
+
 
-        cmd = [
-            "bwrap",
-            "--ro-bind",
-            "/usr",
-            "/usr",
-            "--ro-bind",
-            "/lib",
-            "/lib",
-            "--ro-bind",
-            "/lib64",
-            "/lib64",
-            "--ro-bind",
-            "/etc/resolv.conf",
-            "/etc/resolv.conf", 
-            "--bind",
-            tmpdir,
-            tmpdir,  
-            "--proc",
-            "/proc",
-            "--dev",
-            "/dev",
-            "--unshare-pid",
-            "--die-with-parent",
-            python_bin,
-            code_file,
-        ]
+def _exec_package(
+    venv_dir: str, files: dict[str, str], test_paths: list[str], shards: int, cancel: CancelToken
+) -> dict:
+    targets = [f"{WORKSPACE_DIR}/{path}" for path in test_paths]
+    sharded = bool(shards and shards > 1)
+    launcher = PACKAGE_LAUNCHER.format(pycache=PYCACHE_DIR, work=WORKSPACE_DIR, tests=targets)
 
+    def write_job(job_dir: str, work_dir: str) -> list[str]:
+        write_workspace(work_dir, files)
+        os.makedirs(os.path.join(job_dir, "output"))
+        if sharded:
+            return shard_argv(shards, targets, package=True)
+        launcher_file = os.path.join(job_dir, "run_tests.py")
+        with open(launcher_file, "w") as f:
+            f.write(launcher)
+        return [launcher_file]
+
+    if SANDBOX_POOL_SIZE > 0:
         try:
-            result = subprocess.run(
-                cmd, capture_output=True, text=True, timeout=30, cwd=tmpdir
-            )
-            success = result.returncode in (0, )
-            log("RUN", f"{'✅' if success else '❌'} returncode={result.returncode}")
-            if not success:
-                log("ERR", f"stderr: {result.stderr}")
-            return {
-                "success": success,
-                "stdout": result.stdout[:3000],
-                "stderr": result.stderr[:2000],
-            }
-        except subprocess.TimeoutExpired:
-            return {"success": False, "stdout": "", "stderr": "Timeout (30s exceeded)"}
+            return _run_pooled(venv_dir, write_job, report=True, cancel=cancel, sharded=sharded)
         except Exception as e:
-            return {"success": False, "stdout": "", "stderr": str(e)}
+            log("ERR", f"sandbox pool unavailable, running standalone: {e}")
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        work_dir = os.path.join(tmpdir, "work")
+        os.makedirs(work_dir)
+        argv = write_job(tmpdir, work_dir)
+        python_bin = os.path.join(venv_dir, "bin", "python3")
+        cmd = bwrap_args(venv_dir, tmpdir, [SHARD_SCRIPT], workspace_binds(work_dir)) + [python_bin] + argv
+        return _run_standalone(cmd, tmpdir, report=True, cancel=cancel, sharded=sharded)
 
 
 def tool_read_file(path: str) -> str:
@@ -124,6 +271,7 @@ def tool_write_file(path: str, content: str) -> str:
     try:
         with open(safe_path, "w") as f:
             f.write(content)
+        SNAPSHOT.update(safe_path)
         return f"File written: {safe_path}"
     except Exception as e:
         return f"Error: {e}"
@@ -138,11 +286,20 @@ def tool_list_files() -> str:
     return "\n".join(result) if result else "No files."
 
 
+def _shard_count(value) -> int:
+    # shards comes straight from the model's JSON: "4", 4.0 and junk alike.
+    try:
+        shards = int(value)
+    except (TypeError, ValueError):
+        return 1
+    return max(1, min(shards, os.cpu_count() or 1))
+
+
 TOOLS_DISPATCH = {
     "web_search": lambda args: tool_web_search(args["query"]),
     "fetch_url": lambda args: tool_fetch_url(args["url"]),
     "exec_code": lambda args: tool_exec_code(
-        args["code"], args.get("requirements", [])
+        args["code"], args.get("requirements", []), _shard_count(args.get("shards"))
     ),
     "read_file": lambda args: tool_read_file(args["path"]),
     "write_file": lambda args: tool_write_file(args["path"], args["content"]),
@@ -150,8 +307,16 @@ TOOLS_DISPATCH = {
 }
 
 
+TOOLS_EXECUTOR = ThreadPoolExecutor(max_workers=TOOL_WORKERS, thread_name_prefix="tool")
+
+
 def dispatch_tool(name: str, args: dict):
     fn = TOOLS_DISPATCH.get(name)
     if not fn:
         return f"Unknown tool: {name}"
-    return fn(args)
\ No newline at end of file
+    return fn(args)
+
+
+async def adispatch_tool(name: str, args: dict):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(TOOLS_EXECUTOR, dispatch_tool, name, args)
\ No newline at end of file
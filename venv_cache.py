@@ -0,0 +1,280 @@
+import os
+import re
+import time
+import fcntl
+import shutil
+import hashlib
+import threading
+import subprocess
+from contextlib import contextmanager
+from config import (
+    VENV_CACHE_DIR,
+    VENV_CACHE_MAX_BYTES,
+    WHEELHOUSE_DIR,
+    PIP_TIMEOUT,
+    DEPENDENCY_FAILURE_TTL,
+)
+from logger import log
+
+class DependencyError(Exception):
+    pass
+
+
+_lock = threading.Lock()
+_key_locks: dict[str, threading.Lock] = {}
+_stats = {"hits": 0, "misses": 0, "evictions": 0}
+_failures: dict[str, tuple[float, str]] = {}
+# Users of each venv in this process; evict_venvs never removes one in use.
+_refs: dict[str, int] = {}
+
+# Written once the install has succeeded: a venv directory without it is a
+# build in progress, or one that died half-way.
+COMPLETE_MARKER = ".complete"
+
+
+def normalize_requirements(requirements: list[str]) -> list[str]:
+    normalized = set()
+    for req in requirements or []:
+        req = req.strip()
+        if not req:
+            continue
+        match = re.match(r"^([A-Za-z0-9][A-Za-z0-9._-]*)(.*)$", req)
+        if match:
+            name = re.sub(r"[-_.]+", "-", match.group(1)).lower()
+            req = name + re.sub(r"\s+", "", match.group(2))
+        normalized.add(req)
+    return sorted(normalized)
+
+
+def requirements_key(requirements: list[str]) -> str:
+    payload = "\n".join(normalize_requirements(requirements))
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:32]
+
+
+def venv_cache_stats() -> dict:
+    with _lock:
+        return dict(_stats)
+
+
+def _dir_size(path: str) -> int:
+    total = 0
+    for root, _, files in os.walk(path):
+        for fname in files:
+            fpath = os.path.join(root, fname)
+            if not os.path.islink(fpath):
+                try:
+                    total += os.path.getsize(fpath)
+                except OSError:
+                    pass
+    return total
+
+
+def _run_pip_timed(cmd: list[str]) -> tuple[int, str, dict]:
+    # pip reports one "Collecting"/"Processing" line per package; the time
+    # until the next such line is attributed to that package.
+    proc = subprocess.Popen(
+        cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True
+    )
+    watchdog = threading.Timer(PIP_TIMEOUT, proc.kill)
+    watchdog.start()
+    output = []
+    timings = {}
+    current, since = None, time.monotonic()
+    try:
+        for line in proc.stdout:
+            output.append(line)
+            match = re.match(r"^\s*(?:Collecting|Processing) (\S+)", line)
+            if match:
+                now = time.monotonic()
+                if current:
+                    timings[current] = timings.get(current, 0.0) + now - since
+                current, since = os.path.basename(match.group(1)), now
+        proc.wait()
+    finally:
+        watchdog.cancel()
+    if current:
+        timings[current] = timings.get(current, 0.0) + time.monotonic() - since
+    return proc.returncode, "".join(output), timings
+
+
+def _log_timings(phase: str, timings: dict):
+    for name, seconds in sorted(timings.items(), key=lambda x: -x[1]):
+        log("RUN", f"  📦 {phase} {name}: {seconds:.2f}s")
+
+
+def _install_requirements(python_bin: str, requirements: list[str]):
+    if not requirements:
+        return
+    os.makedirs(WHEELHOUSE_DIR, exist_ok=True)
+    pip = [python_bin, "-m", "pip", "--disable-pip-version-check"]
+    install = pip + ["install", "--no-index", "--find-links", WHEELHOUSE_DIR] + requirements
+
+    start = time.monotonic()
+    returncode, output, timings = _run_pip_timed(install)
+    if returncode != 0:
+        log("RUN", f"🛞 Wheelhouse miss, resolving {', '.join(requirements)}")
+        fetch = pip + ["wheel", "--wheel-dir", WHEELHOUSE_DIR, "--find-links", WHEELHOUSE_DIR]
+        returncode, output, fetch_timings = _run_pip_timed(fetch + requirements)
+        _log_timings("resolve", fetch_timings)
+        if returncode != 0:
+            raise DependencyError(output[-1500:])
+        start = time.monotonic()
+        returncode, output, timings = _run_pip_timed(install)
+        if returncode != 0:
+            raise DependencyError(output[-1500:])
+
+    log("RUN", f"📦 Offline install of {len(requirements)} requirement(s) in {time.monotonic() - start:.1f}s")
+    _log_timings("install", timings)
+
+
+def _build_venv(target: str, requirements: list[str]):
+    subprocess.run(["python3", "-m", "venv", target], capture_output=True)
+    _install_requirements(os.path.join(target, "bin", "python3"), requirements)
+
+
+@contextmanager
+def _build_lock(key: str, blocking: bool = True):
+    # Serializes building and evicting a venv across threads and processes.
+    # Yields False if blocking is off and the lock is taken.
+    fd = os.open(os.path.join(VENV_CACHE_DIR, f".{key}.lock"), os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+        except BlockingIOError:
+            yield False
+            return
+        yield True
+    finally:
+        os.close(fd)
+
+
+def _hold(venv_dir: str) -> bool:
+    # Takes a reference if the venv is complete; checked under _lock so that
+    # evict_venvs cannot remove it in between.
+    with _lock:
+        marker = os.path.join(venv_dir, COMPLETE_MARKER)
+        if not os.path.exists(marker):
+            return False
+        os.utime(marker)
+        _refs[venv_dir] = _refs.get(venv_dir, 0) + 1
+        return True
+
+
+def hold_venv(venv_dir: str):
+    """Marks a venv returned by get_venv as used by one more caller."""
+    with _lock:
+        _refs[venv_dir] = _refs.get(venv_dir, 0) + 1
+
+
+def release_venv(venv_dir: str):
+    with _lock:
+        count = _refs.get(venv_dir, 0) - 1
+        if count > 0:
+            _refs[venv_dir] = count
+        else:
+            _refs.pop(venv_dir, None)
+
+
+@contextmanager
+def use_venv(requirements: list[str]):
+    """get_venv for the duration of a with block."""
+    venv_dir = get_venv(requirements)
+    try:
+        yield venv_dir
+    finally:
+        release_venv(venv_dir)
+
+
+def evict_venvs(max_bytes: int = VENV_CACHE_MAX_BYTES, keep: str = ""):
+    if not os.path.isdir(VENV_CACHE_DIR):
+        return
+    entries = []
+    for name in os.listdir(VENV_CACHE_DIR):
+        path = os.path.join(VENV_CACHE_DIR, name)
+        marker = os.path.join(path, COMPLETE_MARKER)
+        if name.startswith(".") or not os.path.exists(marker):
+            continue
+        entries.append((os.path.getmtime(marker), name, path, _dir_size(path)))
+
+    total = sum(size for _, _, _, size in entries)
+    for _, key, path, size in sorted(entries):
+        if total <= max_bytes:
+            break
+        if path == keep:
+            continue
+        with _build_lock(key, blocking=False) as locked:
+            if not locked:
+                continue
+            with _lock:
+                if _refs.get(path):
+                    continue
+                # Without its marker the venv counts as unbuilt, so a
+                # concurrent get_venv waits on the lock and rebuilds it.
+                try:
+                    os.remove(os.path.join(path, COMPLETE_MARKER))
+                except OSError:
+                    continue
+            log("RUN", f"🧹 venv cache evict {key[:12]} ({size // 1024} KiB)")
+            shutil.rmtree(path, ignore_errors=True)
+        total -= size
+        with _lock:
+            _stats["evictions"] += 1
+
+
+def get_venv(requirements: list[str]) -> str:
+    """Path of a venv with requirements installed, built on first use.
+
+    The caller holds a reference to it until release_venv, which keeps it
+    from being evicted while in use; use_venv does both.
+    """
+    normalized = normalize_requirements(requirements)
+    key = requirements_key(normalized)
+    venv_dir = os.path.join(VENV_CACHE_DIR, key)
+
+    with _lock:
+        key_lock = _key_locks.setdefault(key, threading.Lock())
+
+    with key_lock:
+        failure = _failures.get(key)
+        if failure and time.monotonic() - failure[0] < DEPENDENCY_FAILURE_TTL:
+            log("RUN", f"⛔ Known unresolvable requirements {key[:12]}, failing fast")
+            raise DependencyError(failure[1])
+
+        os.makedirs(VENV_CACHE_DIR, exist_ok=True)
+        # Built in place, under the lock, because console scripts in bin/
+        # hardcode the venv path in their shebang: a venv cannot be moved.
+        with _build_lock(key):
+            if _hold(venv_dir):
+                with _lock:
+                    _stats["hits"] += 1
+                    stats = dict(_stats)
+                log(
+                    "RUN",
+                    f"♻️  venv cache hit {key[:12]} (hits={stats['hits']} misses={stats['misses']})",
+                )
+                return venv_dir
+
+            with _lock:
+                _stats["misses"] += 1
+                stats = dict(_stats)
+            log(
+                "RUN",
+                f"🏗️  venv cache miss {key[:12]}: {', '.join(normalized) or 'no deps'} "
+                f"(hits={stats['hits']} misses={stats['misses']})",
+            )
+            start = time.monotonic()
+            shutil.rmtree(venv_dir, ignore_errors=True)
+            try:
+                _build_venv(venv_dir, normalized)
+            except DependencyError as e:
+                shutil.rmtree(venv_dir, ignore_errors=True)
+                _failures[key] = (time.monotonic(), str(e))
+                log("ERR", f"Dependency installation failed for {', '.join(normalized)}")
+                raise
+            with open(os.path.join(venv_dir, COMPLETE_MARKER), "w"):
+                pass
+            hold_venv(venv_dir)
+
+        log("RUN", f"✅ venv {key[:12]} ready in {time.monotonic() - start:.1f}s")
+    evict_venvs(keep=venv_dir)
+    return venv_dir
\ No newline at end of file
@@ -17,7 +17,7 @@ def start_main():
         subprocess.run(
             [sys.executable, "-m", "pip", "install", "-r", req_file], check=False
         )
-    return subprocess.Popen([sys.executable, MAIN_SCRIPT], ...)
+    return subprocess.Popen([sys.executable, MAIN_SCRIPT])
 
 def main():
     log("👁️  Watcher started")
@@ -0,0 +1,136 @@
+import time
+import threading
+from typing import Callable, Optional
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+import requests
+from config import WEB_CACHE_DIR, WEB_CACHE_MAX_BYTES, WEB_OFFLINE
+from disk_cache import DiskCache, cache_key
+from net import get_session
+from logger import log
+
+WEB_CACHE = DiskCache(WEB_CACHE_DIR, WEB_CACHE_MAX_BYTES, "web cache")
+
+_lock = threading.Lock()
+_stats = {
+    "requests": 0,
+    "fresh_hits": 0,
+    "revalidated": 0,
+    "stale_served": 0,
+    "misses": 0,
+    "offline_misses": 0,
+    "bytes_saved": 0,
+}
+
+OUTCOMES = {"fresh_hits": "hit", "revalidated": "revalidated (304)", "stale_served": "served stale copy"}
+
+
+def normalize_url(url: str) -> str:
+    url = url.strip()
+    try:
+        parts = urlsplit(url)
+        port = parts.port
+    except ValueError:
+        return url
+    scheme = (parts.scheme or "http").lower()
+    host = (parts.hostname or "").lower()
+    if port is not None and (scheme, port) not in (("http", 80), ("https", 443)):
+        host = f"{host}:{port}"
+    query = urlencode(sorted(parse_qsl(parts.query, keep_blank_values=True)))
+    return urlunsplit((scheme, host, parts.path or "/", query, ""))
+
+
+def normalize_query(query: str) -> str:
+    return " ".join(query.lower().split())
+
+
+def web_cache_stats() -> dict:
+    with _lock:
+        stats = dict(_stats)
+    served = stats["fresh_hits"] + stats["revalidated"] + stats["stale_served"]
+    stats["hit_rate"] = served / stats["requests"] if stats["requests"] else 0.0
+    return stats
+
+
+def _count(outcome: str, entry: Optional[dict] = None) -> dict:
+    with _lock:
+        _stats["requests"] += 1
+        _stats[outcome] += 1
+        if entry and outcome != "misses":
+            _stats["bytes_saved"] += entry.get("size", 0)
+    return web_cache_stats()
+
+
+def _log_served(outcome: str, label: str, entry: dict):
+    stats = _count(outcome, entry)
+    log(
+        "TOOL",
+        f"♻️  Web cache {OUTCOMES[outcome]}: {label} "
+        f"(hit rate {stats['hit_rate']:.0%}, {stats['bytes_saved'] / 1024:.1f} KiB saved)",
+    )
+
+
+def cached_get(
+    kind: str,
+    key_text: str,
+    url: str,
+    ttl: float,
+    render: Callable[[requests.Response], str],
+    params: dict = None,
+    headers: dict = None,
+    timeout: float = 15,
+) -> str:
+    """Rendered text of a GET, served from the web cache when possible.
+
+    Fresh entries are returned directly. Stale ones are revalidated with
+    their ETag/Last-Modified and kept on a 304, or served as-is when the
+    network fails. With WEB_OFFLINE, only cached entries are served.
+    """
+    key = cache_key(kind, key_text)
+    entry = WEB_CACHE.get(key)
+    label = f"{kind} {key_text[:80]}"
+
+    if entry and time.time() - entry["fetched_at"] < ttl:
+        _log_served("fresh_hits", label, entry)
+        return entry["text"]
+    if WEB_OFFLINE:
+        if entry:
+            _log_served("stale_served", label, entry)
+            return entry["text"]
+        _count("offline_misses")
+        raise RuntimeError("offline mode and no cached copy")
+
+    headers = dict(headers or {})
+    if entry and entry.get("etag"):
+        headers["If-None-Match"] = entry["etag"]
+    if entry and entry.get("last_modified"):
+        headers["If-Modified-Since"] = entry["last_modified"]
+
+    try:
+        resp = get_session().get(url, params=params, headers=headers, timeout=timeout)
+    except requests.RequestException:
+        if not entry:
+            raise
+        _log_served("stale_served", label, entry)
+        return entry["text"]
+
+    if resp.status_code == 304 and entry:
+        entry["fetched_at"] = time.time()
+        WEB_CACHE.put(key, entry)
+        _log_served("revalidated", label, entry)
+        return entry["text"]
+
+    text = render(resp)
+    _count("misses")
+    if resp.ok:
+        WEB_CACHE.put(
+            key,
+            {
+                "url": url,
+                "fetched_at": time.time(),
+                "etag": resp.headers.get("ETag"),
+                "last_modified": resp.headers.get("Last-Modified"),
+                "size": len(resp.content),
+                "text": text,
+            },
+        )
+    return text
\ No newline at end of file